@@ -0,0 +1,10 @@
+"""
+Benchmarks, run from the repository root:
+- generate: deterministic synthetic ledgers to benchmark against
+- hot_paths: file, month edit, summary, and directory scan timings, as
+  JSON, compared with a stored baseline
+- backends: CSV and SQLite storage compared on the same data
+- startup: command-line startup time against a budget
+
+Ex: python -m benchmarks.hot_paths --sizes small,medium -o results.json
+"""
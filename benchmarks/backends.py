@@ -0,0 +1,109 @@
+"""
+Compares the CSV and SQLite storage backends on the same data:
+- load: every month, through a Ledger
+- insert: rows added to a new month, then saved
+- aggregate: totals for every month, from the loaded Ledger and straight
+  from storage (for SQLite, a GROUP BY in the database)
+
+    python -m benchmarks.backends test_dir --rows 1000
+
+The directory is copied to a temporary one and migrated into a temporary
+database, so it's never modified. Times are the best of several runs.
+"""
+
+import argparse
+from contextlib import redirect_stdout
+import os
+import shutil
+import tempfile
+import time
+from ledger import Ledger
+from migrate import migrate
+from reader import MonthlyFinances
+from storage import CSVStorage
+from storage import SQLiteStorage
+
+
+ROW = ['15', 'Benchmark', 'Expense', 'Food', 'Groceries', '12.34', '']
+
+
+def best_time(func, repeat):
+    """Returns the shortest of several timed calls to func, in seconds."""
+    times = []
+    for run in range(repeat):
+        start = time.perf_counter()
+        func(run)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def insert_rows(storage, run, rows):
+    """Adds rows to an empty month and saves it."""
+    content = MonthlyFinances('1900', f'{run + 1:02}', storage=storage)
+    for i in range(rows):
+        content.add_row(ROW)
+    content.close_month(save=True)
+
+
+def aggregate(storage):
+    """Totals every month without keeping a Ledger around."""
+    if isinstance(storage, SQLiteStorage):
+        return storage.summarize()
+    return Ledger(storage=storage).load().summarize()
+
+
+def run(storage, rows, repeat):
+    """
+    Times each operation against a backend.
+
+    :return: Dict of operation -> seconds
+    """
+    ledger = Ledger(storage=storage).load()
+    return {
+        'load': best_time(lambda run: Ledger(storage=storage).load(),
+                          repeat),
+        f'insert {rows}': best_time(
+            lambda run: insert_rows(storage, run, rows), repeat),
+        'aggregate (loaded)': best_time(lambda run: ledger.summarize(),
+                                        repeat),
+        'aggregate (storage)': best_time(lambda run: aggregate(storage),
+                                         repeat),
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Compare the CSV and SQLite storage backends.')
+    parser.add_argument('directory', nargs='?', default='test_dir',
+                        help='Directory of CSV month files to test with')
+    parser.add_argument('--rows', type=int, default=1000,
+                        help='Rows to add in the insert test')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per test, the best is reported')
+    args = parser.parse_args(args)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        directory = os.path.join(scratch, 'csv')
+        shutil.copytree(args.directory, directory)
+        backends = {
+            'csv': CSVStorage(directory),
+            'sqlite': SQLiteStorage(os.path.join(scratch, 'bench.db')),
+        }
+
+        # Messages from MonthlyFinances would drown out the results
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            migrate(backends['csv'], backends['sqlite'])
+            results = {name: run(storage, args.rows, args.repeat)
+                       for name, storage in backends.items()}
+
+        backends['sqlite'].close()
+
+    print(f"{'':<22}{'csv':>12}{'sqlite':>12}")
+    for test in results['csv']:
+        print(f"{test:<22}{results['csv'][test]:>11.4f}s"
+              f"{results['sqlite'][test]:>11.4f}s")
+    return results
+
+
+if __name__ == '__main__':
+    main()
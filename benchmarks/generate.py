@@ -0,0 +1,93 @@
+"""
+Deterministic synthetic ledgers for benchmarks.
+
+    python -m benchmarks.generate bench_dir --years 5 --rows 300
+
+Writes years x 12 month files of rows transactions each, drawn from the
+categories.categories taxonomy. The same seed always gives the same
+files, so timings from different runs are comparable.
+"""
+
+import argparse
+import calendar
+import os
+import random
+from categories import categories
+from categories import keys
+from file_handler import FileCSV
+
+
+COMPANIES = ['Big Cafe', 'Amazon', 'Costco', 'Target', 'Shell', 'Safeway',
+             'Landlord LLC', 'City Utilities', 'Comcast', 'Verizon',
+             'Acme Corp', 'Corner Pharmacy', 'Cinema 8', 'Steam', 'Delta',
+             'Marriott', 'Petco', 'Home Depot', 'IKEA', 'Barber Shop',
+             'State DMV', 'Post Office', 'Book Nook', 'Gym Co', 'Uber']
+
+NOTES = ['', '', '', '', 'monthly bill', 'gift', 'split with roommate',
+         'reimbursable', 'online order']
+
+
+def generate_rows(rnd, year, month, rows):
+    """Returns rows of strings for one month, sorted by day."""
+    subcategories = [(trans, cat, sub)
+                     for trans, cats in categories.items()
+                     for cat, subs in cats.items()
+                     for sub in subs]
+    last = calendar.monthrange(year, month)[1]
+
+    content = []
+    for i in range(rows):
+        trans, cat, sub = rnd.choice(subcategories)
+        cents = min(int(rnd.lognormvariate(8, 1.2)), 500000)
+        content.append([str(rnd.randint(1, last)), rnd.choice(COMPANIES),
+                        trans, cat, sub, f'{cents // 100}.{cents % 100:02}',
+                        rnd.choice(NOTES)])
+    content.sort(key=lambda row: int(row[0]))
+    return content
+
+
+def generate_ledger(directory, years=10, rows=300, seed=0,
+                    first_year=2014):
+    """
+    Writes a directory of month files.
+
+    :param directory: Where to write YYYY-MM.csv files. Created if needed.
+    :param years: Number of years, each with 12 months
+    :param rows: Transactions per month
+    :param seed: Seed for the random choices
+    :param first_year: Year of the first month
+    :return: List of (year, month) pairs written
+    """
+    os.makedirs(directory, exist_ok=True)
+    rnd = random.Random(seed)
+
+    dates = []
+    for year in range(first_year, first_year + years):
+        for month in range(1, 13):
+            content = generate_rows(rnd, year, month, rows)
+            perm_file = FileCSV(
+                os.path.join(directory, f'{year}-{month:02}.csv'), 'never')
+            perm_file.write_content([keys] + content)
+            dates.append((f'{year}', f'{month:02}'))
+    return dates
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Write a synthetic ledger of month files.')
+    parser.add_argument('directory')
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--rows', type=int, default=300,
+                        help='Transactions per month')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--first-year', type=int, default=2014)
+    args = parser.parse_args(args)
+
+    dates = generate_ledger(args.directory, args.years, args.rows,
+                            args.seed, args.first_year)
+    print(f"Wrote {len(dates)} month(s) of {args.rows} row(s) to "
+          f"{args.directory}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""
+Times the hot paths of the data layer on synthetic ledgers of several
+sizes, and flags regressions against a stored baseline.
+
+    python -m benchmarks.hot_paths --sizes small,medium -o results.json
+    python -m benchmarks.hot_paths --save-baseline
+
+Each case is timed several times and the best run is kept, as seconds per
+operation. Results are written as JSON, keyed 'size:case'. A case is a
+regression if it's more than --threshold slower than the baseline, in
+which case the exit status is 1.
+"""
+
+import argparse
+from contextlib import redirect_stdout
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from benchmarks.generate import generate_ledger
+from file_handler import DirReader
+from file_handler import FileCSV
+from reader import MonthlyFinances
+
+
+# Size name -> (years, rows per month)
+SIZES = {
+    'small': (1, 100),
+    'medium': (5, 300),
+    'large': (10, 1000),
+}
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# Quick cases are repeated within a run until it takes at least this long
+MIN_RUN = 0.02
+
+ROW = ['14', 'Big Cafe', 'Expense', 'Food', 'Restaurants', '12.34', '']
+
+
+def best_time(func, repeat, setup=None, teardown=None, ops=1):
+    """
+    Returns the best time of several runs, in seconds per operation.
+
+    :param func: Timed function, called with whatever setup returns
+    :param setup: Untimed function run before each run
+    :param teardown: Untimed function run after each run, with the same
+     argument as func
+    :param ops: Number of operations func does, to divide the time by
+    """
+    # Without a setup, func can be called back to back, so call it enough
+    # times per run to be timed reliably
+    number = 1
+    if setup is None:
+        while True:
+            start = time.perf_counter()
+            for i in range(number):
+                func(None)
+            if time.perf_counter() - start >= MIN_RUN:
+                break
+            number *= 2
+
+    # Like timeit, keep garbage collection out of the timings
+    times = []
+    for run in range(repeat):
+        state = setup() if setup else None
+        gc.disable()
+        start = time.perf_counter()
+        for i in range(number):
+            func(state)
+        times.append((time.perf_counter() - start) / (ops * number))
+        gc.enable()
+        if teardown:
+            teardown(state)
+    return min(times)
+
+
+def bench_size(directory, dates, repeat, ops):
+    """
+    Times every case against one generated ledger.
+
+    :return: Dict of case -> seconds per operation
+    """
+    year, month = dates[-1]
+    perm_file = FileCSV(os.path.join(directory, f'{year}-{month}.csv'),
+                        'never')
+    content = perm_file.get_content()
+    scratch = FileCSV(os.path.join(directory, 'scratch.csv'), 'never')
+    rnd = random.Random(0)
+
+    def open_month():
+        return MonthlyFinances(year, month, directory, fsync='never')
+
+    def close_month(content):
+        content.close_month(save=False)
+
+    def add_rows(content):
+        for i in range(ops):
+            content.add_row(ROW)
+        content.flush()
+
+    def replace_rows(content):
+        order = content.order
+        for i in range(ops):
+            content.replace_row(rnd.choice(order), ROW)
+        content.flush()
+
+    # Small months don't have ops rows to delete
+    deletes = min(ops, len(content) - 1)
+
+    def del_rows(content):
+        for i in range(deletes):
+            content.del_row(rnd.choice(content.order))
+        content.flush()
+
+    reader = DirReader(directory)
+    reader.refresh()
+    readout = open_month()
+
+    return {
+        'file.get_content': best_time(
+            lambda state: perm_file.get_content(), repeat),
+        'file.write_content': best_time(
+            lambda state: scratch.write_content(content), repeat),
+        'month.load': best_time(lambda state: open_month(), repeat),
+        'month.add_row': best_time(add_rows, repeat, open_month,
+                                   close_month, ops),
+        'month.replace_row': best_time(replace_rows, repeat, open_month,
+                                       close_month, ops),
+        'month.del_row': best_time(del_rows, repeat, open_month,
+                                   close_month, deletes),
+        'month.simple_readout': best_time(
+            lambda state: readout.simple_readout(), repeat),
+        'dir_reader.scan': best_time(
+            lambda state: DirReader(directory).get_month_files(), repeat),
+        'dir_reader.cached': best_time(
+            lambda state: reader.get_month_files(), repeat),
+    }
+
+
+def run(sizes, repeat=5, ops=200):
+    """
+    Generates a ledger for each size and times every case against it.
+
+    :return: Dict of 'size:case' -> seconds per operation
+    """
+    results = {}
+    for size in sizes:
+        years, rows = SIZES[size]
+        with tempfile.TemporaryDirectory() as directory:
+            dates = generate_ledger(directory, years, rows)
+
+            # Messages from MonthlyFinances would drown out the results
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                for case, seconds in bench_size(directory, dates, repeat,
+                                                ops).items():
+                    results[f'{size}:{case}'] = seconds
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns (name, baseline seconds, seconds) for every case that is more
+    than threshold slower than its baseline, ex threshold=0.25 for 25%.
+    """
+    return [(name, baseline[name], seconds)
+            for name, seconds in results.items()
+            if name in baseline
+            and seconds > baseline[name] * (1 + threshold)]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Time the data layer and compare with a baseline.')
+    parser.add_argument('--sizes', default='small,medium',
+                        help=f"Comma-separated sizes from {list(SIZES)}")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Runs per case, the best is reported')
+    parser.add_argument('--ops', type=int, default=200,
+                        help='Edits per run in the add/replace/del cases')
+    parser.add_argument('-o', '--output', help='Write results as JSON')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='Baseline JSON to compare with')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store these results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Slowdown that counts as a regression')
+    args = parser.parse_args(args)
+
+    results = run(args.sizes.split(','), args.repeat, args.ops)
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f_obj:
+            baseline = json.load(f_obj)['results']
+    regressions = {name for name, base, seconds
+                   in compare(results, baseline, args.threshold)}
+
+    for name, seconds in results.items():
+        line = f"{name:<34}{seconds * 1e6:>12.1f}us"
+        if name in baseline:
+            change = seconds / baseline[name] - 1
+            line += f"  {change:+7.1%}"
+            if name in regressions:
+                line += '  REGRESSION'
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as f_obj:
+            json.dump(report, f_obj, indent=4)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f_obj:
+            json.dump(report, f_obj, indent=4)
+        print(f"Saved baseline to {args.baseline}")
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+Measures how long the command-line entry point takes to start.
+
+    python -m benchmarks.startup
+
+Each case runs in a fresh interpreter, several times, and its best time
+is compared with that of an interpreter that does nothing. A case fails
+if it costs more than BUDGET_MS on top of that, or if it loads tkinter.
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+
+
+# Milliseconds a case may take on top of a bare interpreter start
+BUDGET_MS = 75
+
+# Modules the commands import when they run
+COMMAND_MODULES = 'duplicates, importer, ledger, query, reader, search'
+
+# Name -> interpreter arguments. Cases exit with status 3 if tkinter was
+# imported.
+CASES = {
+    'cli --help': ['-c', "import sys, cli\n"
+                         "try: cli.main(['--help'])\n"
+                         "except SystemExit: pass\n"
+                         "sys.exit(3 if 'tkinter' in sys.modules else 0)"],
+    'cli + command modules': ['-c', f"import sys, cli, {COMMAND_MODULES}\n"
+                                    f"sys.exit(3 if 'tkinter' in "
+                                    f"sys.modules else 0)"],
+}
+
+
+def best_time(arguments, repeat):
+    """
+    Runs the interpreter with arguments and returns the best time in
+    milliseconds, and the exit status.
+    """
+    times = []
+    for run in range(repeat):
+        start = time.perf_counter()
+        status = subprocess.run([sys.executable, *arguments],
+                                stdout=subprocess.DEVNULL).returncode
+        times.append((time.perf_counter() - start) * 1000)
+    return min(times), status
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Measure command-line startup time.')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='Runs per case, the best is reported')
+    args = parser.parse_args(args)
+
+    bare, status = best_time(['-c', 'pass'], args.repeat)
+    print(f"{'bare interpreter':<24}{bare:>8.1f}ms")
+
+    failed = False
+    for name, arguments in CASES.items():
+        elapsed, status = best_time(arguments, args.repeat)
+        extra = elapsed - bare
+        verdict = 'ok'
+        if status == 3:
+            verdict = 'FAIL: imports tkinter'
+        elif status:
+            verdict = f'FAIL: exit status {status}'
+        elif extra > BUDGET_MS:
+            verdict = f'FAIL: over the {BUDGET_MS}ms budget'
+        failed = failed or verdict != 'ok'
+        print(f"{name:<24}{elapsed:>8.1f}ms  +{extra:.1f}ms  {verdict}")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
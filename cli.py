@@ -0,0 +1,334 @@
+"""
+Command-line access to transaction data, without the GUI. Ex:
+
+    python -m cli summary --year 2023
+    python -m cli search "amazon book*"
+    python -m cli import statement.csv --date-format %Y-%m-%d
+    python -m cli export --start 2023-01 --end 2023-06 -o half.csv
+    python -m cli validate
+
+Every command takes --data: a directory of CSV month files (test_dir by
+default) or a SQLite database file, ex finances.db. With --metrics, timings
+and row and byte counts for the command are printed to stderr afterwards,
+or with --metrics-json FILE, saved as JSON. Ex:
+
+    python -m cli --metrics summary --year 2023
+
+Messages, ex about a recovered journal, go to stderr, so stdout only
+holds the command's output. Messages for single rows are left out unless
+--verbose is given. If a command fails with an unexpected error, the
+latest events are printed to stderr before the traceback.
+
+Only argparse is imported up front. Each command imports the modules it
+needs when it runs, and nothing here imports tkinter, so commands start
+fast enough to run from cron jobs and scripts.
+"""
+
+import argparse
+import os
+import sys
+
+
+# Skipped rows listed after an import; the rest are only counted
+SHOW_SKIPPED = 10
+
+
+def get_storage(args):
+    """Returns the storage backend named by --data."""
+    from storage import open_storage
+    return open_storage(args.data, args.fsync)
+
+
+def error(message):
+    """Prints an error to stderr and returns the exit status for it."""
+    print(f"ERR: {message}", file=sys.stderr)
+    return 2
+
+
+def cmd_summary(args):
+    """Prints the totals of a month, a year, or everything, as JSON."""
+    import json
+
+    storage = get_storage(args)
+    if args.month:
+        if args.year is None:
+            return error("--month needs --year")
+        if (args.year, args.month) not in storage.get_month_files():
+            return error(f"no data for {args.year}-{args.month}")
+
+        from reader import MonthlyFinances
+        content = MonthlyFinances(args.year, args.month, storage=storage)
+        summary = content.summarize()
+    else:
+        from ledger import Ledger
+        ledger = Ledger(storage=storage).load(year=args.year)
+        summary = ledger.summarize(args.year)
+
+    for (trans, cat, sub), cents in summary.unknown.items():
+        if cents:
+            print(f"KeyError ::  {trans} / {cat} / {sub}  :: not recognized",
+                  file=sys.stderr)
+
+    print(json.dumps(summary.as_dict(), indent=4))
+    return 0
+
+
+def cmd_search(args):
+    """Prints the transactions whose Company or Note match, as CSV."""
+    import csv
+    from search import SearchIndex
+    from storage import CSVStorage
+
+    storage = get_storage(args)
+    if not isinstance(storage, CSVStorage):
+        return error("search needs a directory of CSV files")
+
+    index = SearchIndex(args.data).load()
+    index.save()
+
+    # Row IDs in the index are positions in each month's file
+    writer = csv.writer(sys.stdout, lineterminator='\n')
+    stores = {}
+    for year, month, rid in index.search(' '.join(args.terms)):
+        if (year, month) not in stores:
+            stores[(year, month)] = storage.load(year, month)[0]
+        writer.writerow([year, month, *stores[(year, month)].get_row(rid)])
+    return 0
+
+
+def cmd_import(args):
+    """Imports bank statement files."""
+    from importer import Importer
+    from importer import StatementFormat
+    import log
+
+    defaults = {}
+    for default in args.default:
+        name, sep, value = default.partition('=')
+        if not sep:
+            return error(f"--default must be NAME=VALUE, not {default!r}")
+        defaults[name] = value
+
+    statement_format = StatementFormat(
+        date=args.date, company=args.company, amount=args.amount,
+        debit=args.debit, credit=args.credit,
+        transaction=args.transaction, category=args.category,
+        subcategory=args.subcategory, note=args.note,
+        date_format=args.date_format,
+        charges_positive=args.charges_positive, defaults=defaults)
+
+    storage = get_storage(args)
+    duplicates = None
+    if args.check_duplicates or args.reject_duplicates:
+        from duplicates import DuplicateIndex
+        duplicates = DuplicateIndex(storage, days=args.fuzzy_days,
+                                    reject=args.reject_duplicates,
+                                    level=log.DEBUG).load()
+
+    importer = Importer(statement_format, storage=storage,
+                        duplicates=duplicates)
+    imported = importer.run(args.files)
+
+    for (year, month), count in imported.items():
+        print(f"{year}-{month}: imported {count} row(s)")
+    print(f"Imported {sum(imported.values())} row(s), skipped "
+          f"{len(importer.skipped)}")
+    for filename, line, err in importer.skipped[:SHOW_SKIPPED]:
+        print(f"  {filename}:{line}: {err}", file=sys.stderr)
+    if len(importer.skipped) > SHOW_SKIPPED:
+        print(f"  ... and {len(importer.skipped) - SHOW_SKIPPED} more",
+              file=sys.stderr)
+    if duplicates is not None:
+        print(f"{len(duplicates.flagged)} duplicate(s) "
+              f"{'rejected' if args.reject_duplicates else 'flagged'}")
+    return 1 if importer.skipped else 0
+
+
+def cmd_export(args):
+    """Writes matching transactions, with their year and month, to CSV."""
+    import csv
+    from categories import keys
+    from query import Query
+
+    try:
+        query = Query(transaction=args.transaction, category=args.category,
+                      subcategory=args.subcategory, company=args.company,
+                      start=args.start, end=args.end)
+    except ValueError as err:
+        return error(err)
+    rows = query.run(get_storage(args))
+
+    f_obj = open(args.output, 'w', newline='') if args.output \
+        else sys.stdout
+    try:
+        writer = csv.writer(f_obj, lineterminator='\n')
+        writer.writerow(['Year', 'Month', *keys])
+        writer.writerows(rows)
+    finally:
+        if args.output:
+            f_obj.close()
+
+    if args.output:
+        print(f"Exported {len(rows)} row(s) to {args.output}")
+    return 0
+
+
+def cmd_validate(args):
+    """Checks every month, and exits with status 1 if anything is wrong."""
+    from calendar import monthrange
+    from reader import MonthlyFinances
+
+    storage = get_storage(args)
+    dates = storage.get_month_files()
+    problems = 0
+
+    def report(year, month, message):
+        nonlocal problems
+        problems += 1
+        print(f"{year}-{month}: {message}")
+
+    for year, month in dates:
+        content = MonthlyFinances(year, month, storage=storage)
+
+        if content.journal.exists:
+            report(year, month, "has unsaved changes in its journal")
+
+        store = content.store
+        invalid = sum(1 for rid in content.order if not store.is_valid(rid))
+        if invalid:
+            report(year, month, f"{invalid} row(s) with a Day or Amount "
+                                f"that can't be read")
+
+        last = monthrange(int(year), int(month))[1]
+        days = store.column('Day').values
+        bad_days = sum(1 for rid in content.order
+                       if not 1 <= days[rid] <= last and store.is_valid(rid))
+        if bad_days:
+            report(year, month, f"{bad_days} row(s) with a day outside "
+                                f"the month")
+
+        for (trans, cat, sub), cents in content.totals.unknown.items():
+            if cents:
+                report(year, month, f"rows with unknown keys "
+                                    f"{trans} / {cat} / {sub}")
+
+        if not content.check_totals():
+            report(year, month, "running totals don't match the rows")
+
+    print(f"Checked {len(dates)} month(s), found {problems} problem(s)")
+    return 1 if problems else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m cli',
+        description='Work with transaction data without the GUI.')
+    parser.add_argument('--data', default='test_dir',
+                        help='CSV directory or SQLite database file '
+                             '(default: %(default)s)')
+    parser.add_argument('--fsync', default='save',
+                        choices=('never', 'save', 'always'),
+                        help='When saved data is forced onto the disk')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Print a message for every row changed')
+    parser.add_argument('--metrics', action='store_true',
+                        help='Print timings and counts to stderr')
+    parser.add_argument('--metrics-json', metavar='FILE',
+                        help='Save timings and counts as JSON')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    summary = commands.add_parser('summary', help='Print totals as JSON')
+    summary.add_argument('--year', help='Ex 2023')
+    summary.add_argument('--month', help='Ex 08, needs --year')
+    summary.set_defaults(func=cmd_summary)
+
+    search = commands.add_parser(
+        'search', help='Find transactions by Company or Note')
+    search.add_argument('terms', nargs='+',
+                        help="Words to find. 'book*' matches a prefix.")
+    search.set_defaults(func=cmd_search)
+
+    imports = commands.add_parser('import',
+                                  help='Import bank statement CSV files')
+    imports.add_argument('files', nargs='+')
+    imports.add_argument('--date', default='Date',
+                         help='Date column (default: %(default)s)')
+    imports.add_argument('--date-format', default='%m/%d/%Y',
+                         help='strptime format (default: %(default)s)')
+    imports.add_argument('--company', default='Description',
+                         help='Payee column (default: %(default)s)')
+    imports.add_argument('--amount', default='Amount',
+                         help='Signed amount column (default: %(default)s)')
+    imports.add_argument('--debit', help='Money out column')
+    imports.add_argument('--credit', help='Money in column')
+    imports.add_argument('--transaction', help='Income/Expense column')
+    imports.add_argument('--category', help='Category column')
+    imports.add_argument('--subcategory', help='Subcategory column')
+    imports.add_argument('--note', help='Column to copy into Note')
+    imports.add_argument('--charges-positive', action='store_true',
+                         help='Money out is listed as positive')
+    imports.add_argument('--default', action='append', default=[],
+                         metavar='NAME=VALUE',
+                         help='Value for a column, ex Category=Food')
+    imports.add_argument('--check-duplicates', action='store_true',
+                         help='Flag rows that are already stored')
+    imports.add_argument('--reject-duplicates', action='store_true',
+                         help='Skip rows that are already stored')
+    imports.add_argument('--fuzzy-days', type=int, default=0,
+                         help='Duplicates may be this many days apart')
+    imports.set_defaults(func=cmd_import)
+
+    export = commands.add_parser('export',
+                                 help='Write transactions to a CSV file')
+    export.add_argument('--start', help='Ex 2023-01 or 2023-01-15')
+    export.add_argument('--end', help='Ex 2023-06 or 2023')
+    export.add_argument('--transaction', help='Ex Expense')
+    export.add_argument('--category', help='Ex Food')
+    export.add_argument('--subcategory', help='Ex Groceries')
+    export.add_argument('--company', help='Ex Amazon, matched exactly')
+    export.add_argument('-o', '--output', help='File to write, or stdout')
+    export.set_defaults(func=cmd_export)
+
+    validate = commands.add_parser('validate',
+                                   help='Check every month for problems')
+    validate.set_defaults(func=cmd_validate)
+
+    return parser
+
+
+def main(argv=None):
+    """Runs a command and returns its exit status."""
+    args = build_parser().parse_args(argv)
+    if args.metrics or args.metrics_json:
+        from metrics import registry
+        registry.enable()
+
+    # Stdout is for the command's output, ex CSV piped into another
+    # program, so messages go to stderr
+    import log
+    log.set_output(sys.stderr)
+    if args.verbose:
+        log.set_level(log.DEBUG, show=True)
+
+    try:
+        status = args.func(args)
+    except BrokenPipeError:
+        # Output was cut short, ex piped into head. Keep Python from
+        # complaining again when it flushes stdout on exit.
+        sys.stdout = open(os.devnull, 'w')
+        status = 1
+    except Exception:
+        log.dump(sys.stderr, count=50)
+        raise
+
+    if args.metrics:
+        print(registry.report(), file=sys.stderr)
+    if args.metrics_json:
+        import json
+        with open(args.metrics_json, 'w') as f_obj:
+            json.dump(registry.snapshot(), f_obj, indent=4)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""
+Duplicate detection across every month.
+
+Each transaction gets a fingerprint of its date, its Company (lowercased,
+with punctuation and spacing evened out), and its amount in cents. A
+DuplicateIndex counts fingerprints across all months of a storage
+backend, so checking a new row is a few dict lookups, whichever month the
+earlier copy is in. With days=N, rows up to N days apart also match,
+which catches the same charge posted on different days by two exports.
+
+Like SearchIndex, months on file are only read again once their storage
+stamp changes, and a month open for editing is followed through
+MonthlyFinances.subscribe.
+"""
+
+import calendar
+import re
+from collections import Counter
+from datetime import date
+from categories import keys
+import log
+from storage import CSVStorage
+from store import to_cents
+
+
+# Runs of anything but letters and digits, evened out to one space
+SEPARATORS = re.compile(r'[\W_]+')
+
+# Header name -> column index of rows in categories.keys order, ex rows
+# from the importer
+KEY_COLUMNS = {name: i for i, name in enumerate(keys)}
+
+
+def normalize_company(company):
+    """Ex 'AMAZON.COM,  Inc' -> 'amazon com inc'."""
+    return SEPARATORS.sub(' ', company.lower()).strip()
+
+
+class DuplicateIndex:
+    """Fingerprints of every transaction, for spotting duplicates."""
+
+    def __init__(self, storage=None, directory='test_dir', days=0,
+                 reject=False, level=log.WARNING):
+        """
+        :param storage: Backend whose months are indexed
+        :param directory: Directory of CSV files, used if storage is None
+        :param days: Also match rows up to this many days apart
+        :param reject: Refuse duplicates, rather than only flag them
+        :param level: Level of the event for each duplicate found, ex
+         DEBUG for bulk imports that report self.flagged once
+        """
+        if storage is None:
+            storage = CSVStorage(directory)
+        self.storage = storage
+        self.days = days
+        self.reject = reject
+        self.level = level
+
+        self.counts = Counter()     # Fingerprint -> rows with it
+        self.month_keys = {}        # (year, month) -> Counter of its rows
+        self.stamps = {}            # (year, month) -> storage stamp
+
+        # Months open for editing: (year, month) -> {row ID: fingerprint}
+        self.live = {}
+
+        # (year, month, row, dates of the rows it matched), ex for review
+        self.flagged = []
+
+    # Fingerprints
+
+    def fingerprint(self, year, month, row, columns=None):
+        """
+        Returns a row's fingerprint, or None if its date isn't valid.
+
+        :param row: Row of strings
+        :param columns: Header name -> index in row, ex
+         MonthlyFinances.columns. Defaults to categories.keys order.
+        """
+        columns = columns or KEY_COLUMNS
+        try:
+            day = int(row[columns['Day']])
+            ordinal = date(int(year), int(month), day).toordinal()
+        except (ValueError, IndexError):
+            return None
+        return (ordinal, normalize_company(row[columns['Company']]),
+                to_cents(row[columns['Amount']]))
+
+    def _month_fingerprints(self, year, month, store, ids):
+        """Fingerprints the rows of a ColumnStore straight from columns."""
+        first = date(int(year), int(month), 1).toordinal() - 1
+        last = calendar.monthrange(int(year), int(month))[1]
+        days = store.column('Day').export(ids)
+        companies = store.column('Company').export(ids)
+        amounts = store.column('Amount').export(ids)
+        # Companies repeat a lot, so normalize each one once
+        names = {company: normalize_company(company)
+                 for company in set(companies)}
+        return Counter((first + day, names[company], cents)
+                       for day, company, cents
+                       in zip(days, companies, amounts)
+                       if 0 < day <= last)
+
+    # Building the index
+
+    def load(self):
+        """Indexes every month in storage."""
+        self.refresh()
+        return self
+
+    def refresh(self):
+        """Indexes new or changed months and drops deleted ones."""
+        found = set(self.storage.get_month_files())
+        for key in found:
+            if key in self.live:
+                continue
+            stamp = self.storage.get_stamp(*key)
+            if self.stamps.get(key) != stamp:
+                store, ids = self.storage.load(*key)
+                self._set_month(key, self._month_fingerprints(*key, store,
+                                                              ids))
+                self.stamps[key] = stamp
+
+        for key in set(self.stamps) - found:
+            self._set_month(key, Counter())
+            del self.month_keys[key], self.stamps[key]
+
+    def _set_month(self, key, counter):
+        """Replaces the fingerprints counted for a month."""
+        for fingerprint, count in self.month_keys.pop(key, {}).items():
+            self._count(None, fingerprint, -count)
+        self.counts.update(counter)
+        self.month_keys[key] = counter
+
+    def add(self, year, month, row):
+        """Counts a row that isn't in storage yet, ex one being imported."""
+        self._count((year, month), self.fingerprint(year, month, row), 1)
+
+    # Keeping an open month up to date
+
+    def watch(self, content):
+        """
+        Indexes an open MonthlyFinances and follows its edits.
+
+        :param content: MonthlyFinances open for editing
+        """
+        key = (content.year, content.month)
+        columns = content.columns
+        live = self.live[key] = {}
+        counter = Counter()
+        for rid in content.order:
+            live[rid] = self.fingerprint(*key, content.get_entry(rid),
+                                         columns)
+            counter[live[rid]] += 1
+        counter.pop(None, None)
+        self._set_month(key, counter)
+
+        # Recorded as changed, so it's read again once no longer open
+        self.stamps[key] = None
+
+        def listener(event, rid, index):
+            if live is not self.live.get(key):
+                return
+            if event in ('update', 'delete'):
+                self._count(key, live.pop(rid), -1)
+            if event in ('insert', 'update'):
+                live[rid] = self.fingerprint(*key, content.get_entry(rid),
+                                             columns)
+                self._count(key, live[rid], 1)
+
+        content.subscribe(listener)
+
+    def unwatch(self, content):
+        """Stops following a MonthlyFinances, ex once it's closed."""
+        self.live.pop((content.year, content.month), None)
+
+    def _count(self, key, fingerprint, step):
+        """Adds step to a fingerprint's count, and to its month's if key."""
+        if fingerprint is None:
+            return
+        count = self.counts[fingerprint] + step
+        if count > 0:
+            self.counts[fingerprint] = count
+        else:
+            self.counts.pop(fingerprint, None)
+        if key is not None:
+            self.month_keys.setdefault(key, Counter())[fingerprint] += step
+
+    # Checks
+
+    def find(self, year, month, row, columns=None):
+        """
+        Returns the dates of rows that a new row would duplicate, ex
+        ['2023-08-14'], or an empty list.
+
+        :param columns: Header name -> index in row, see fingerprint
+        """
+        key = self.fingerprint(year, month, row, columns)
+        if key is None:
+            return []
+
+        ordinal, company, cents = key
+        matches = []
+        for day in range(ordinal - self.days, ordinal + self.days + 1):
+            count = self.counts.get((day, company, cents), 0)
+            matches.extend([date.fromordinal(day).isoformat()] * count)
+        return matches
+
+    def check(self, year, month, row, columns=None):
+        """
+        Flags a row if it duplicates an existing one.
+
+        :param columns: Header name -> index in row, see fingerprint
+        :return: False if the row is a duplicate and duplicates are
+         rejected, True if it may be added
+        """
+        matches = self.find(year, month, row, columns)
+        if not matches:
+            return True
+
+        self.flagged.append((year, month, row, matches))
+        if log.is_enabled(self.level):
+            log.event(self.level, 'duplicate',
+                      "%(action)s duplicate entry ::  %(row)s  :: matches "
+                      "%(matches)s",
+                      action='Rejected' if self.reject else 'Flagged',
+                      row=row, matches=', '.join(matches))
+        return not self.reject
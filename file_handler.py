@@ -1,18 +1,97 @@
 import os
 import csv
 import calendar
+from bisect import bisect_left
+import marshal
+import threading
+import time
+import log
+from metrics import registry
+from metrics import timed
+
+
+# Bump whenever the layout of the sidecar cache changes
+CACHE_VERSION = 5
+
+# When FileCSV forces written data onto the disk with fsync:
+# - 'never': leave it to the operating system
+# - 'save': after every full save, but not after journal appends
+# - 'always': after every full save and every appended row
+FSYNC_POLICIES = ('never', 'save', 'always')
+
+# Sets the CSV format for writing. Registered on import rather than per
+# FileCSV, so files unpickled in another process can still write.
+csv.register_dialect('default', delimiter=',', lineterminator='\r')
+
+
+def sync_directory(path):
+    """
+    Flushes a directory entry to disk, so a file renamed into it survives
+    a crash. Not supported on every platform (ex Windows), where it's
+    skipped.
+    """
+    try:
+        fd = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_atomic(target, write, binary=False, sync=False):
+    """
+    Writes a file by way of a sibling temporary file that is renamed over
+    the target, so the target is either left as it was or fully replaced,
+    never half-written.
+
+    :param target: Path of the file to replace
+    :param write: Function that writes the content to an open file
+    :param binary: Open the file in binary mode
+    :param sync: Force the file and its directory entry onto the disk
+    """
+    temp = f'{target}.tmp'
+    try:
+        # Text is always UTF-8, the encoding FileCSV.iter_rows reads
+        with open(temp, 'wb') if binary else \
+                open(temp, 'w', encoding='utf-8') as f_obj:
+            write(f_obj)
+            if sync:
+                f_obj.flush()
+                os.fsync(f_obj.fileno())
+        os.replace(temp, target)
+    except BaseException:
+        # Leave the target untouched and tidy up the partial file
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+    if sync:
+        sync_directory(target)
 
 
 class FileCSV:
     """A class for handling CSV file contents."""
 
-    def __init__(self, filename):
-        """Initializes a file by checking if it exists."""
+    def __init__(self, filename, fsync='save'):
+        """
+        Initializes a file by checking if it exists.
+
+        :param fsync: One of FSYNC_POLICIES
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {FSYNC_POLICIES}, "
+                             f"not {fsync!r}")
+
         self.filename = filename
         self.exists = self.check_file_exists()
+        self.fsync = fsync
 
-        # Sets the CSV format for writing
-        csv.register_dialect('default', delimiter=',', lineterminator='\r')
+        # Binary sidecar holding the file's parsed columns
+        self.cache_name = f'{filename}.cache'
 
     def check_file_exists(self):
         """Returns TRUE if file exists, FALSE if not."""
@@ -22,6 +101,65 @@ class FileCSV:
         except FileNotFoundError:
             return False
 
+    def iter_rows(self, skip_header=False, types=None):
+        """
+        Yields the CSV file's rows one at a time, as lists of strings with
+        leading and trailing whitespace removed. Only one row is held in
+        memory at a time.
+
+        A UnicodeDecodeError is raised as-is, so callers can decide whether
+        a partly read file is still useful.
+
+        :param skip_header: Don't yield the first row
+        :param types: Optional dict of header name -> function used to
+         parse that column, ex {'Day': int}. Columns not named are left
+         as strings.
+        """
+        with open(self.filename, encoding='utf-8') as f_obj:
+            # Quoted the same way csv.writer quotes, ex a Company of
+            # "AMAZON, INC" is one field
+            reader = csv.reader(f_obj, dialect='default')
+
+            header = next(reader, None)
+            if header is None:
+                return
+            header = [x.strip() for x in header]
+            if not skip_header:
+                yield header
+
+            # Resolve parsers against the header once, not once per row
+            parsers = []
+            if types:
+                parsers = [(i, types[name]) for i, name in enumerate(header)
+                           if name in types]
+
+            for row in reader:
+                row = [x.strip() for x in row]
+                for i, parse in parsers:
+                    if i < len(row):
+                        row[i] = parse(row[i])
+                yield row
+
+            if registry.enabled:
+                registry.count('file.rows_read', reader.line_num - 1)
+                registry.count('file.bytes_read',
+                               os.fstat(f_obj.fileno()).st_size)
+
+    def iter_chunks(self, size=1000, skip_header=False, types=None):
+        """
+        Yields the CSV file's rows in lists of up to size rows. Takes the
+        same options as iter_rows.
+        """
+        chunk = []
+        for row in self.iter_rows(skip_header, types):
+            chunk.append(row)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    @timed('file.read')
     def get_content(self):
         """
         Returns content of CSV file as a list of lists.
@@ -32,35 +170,136 @@ class FileCSV:
          identify exactly what line in the CSV file caused it.
         """
         try:
-            with open(self.filename, encoding='utf-8') as f_obj:
-                reader = csv.reader(f_obj, delimiter=',',
-                                    quoting=csv.QUOTE_NONE)
-
-                # Removes leading and trailing whitespace
-                return [[x.strip() for x in row] for row in reader]
+            return list(self.iter_rows())
 
         # If you get this, try different encoding settings
         except UnicodeDecodeError as error_code:
-            print(f"*ERR: UnicodeDecodeError when attempting to read "
-                  f"content:\n\t{error_code}")
+            log.event(log.ERROR, 'read_error',
+                      "*ERR: UnicodeDecodeError when attempting to read "
+                      "content:\n\t%(error)s", error=error_code,
+                      file=self.filename)
             return None
 
+    def _write_atomic(self, target, write, binary=False, sync=True):
+        """
+        Writes a file atomically, see write_atomic.
+
+        :param sync: Follow the fsync policy (False for disposable files)
+        """
+        write_atomic(target, write, binary, sync and self.fsync != 'never')
+
+    @timed('file.write')
     def write_content(self, new_content):
-        """Overwrites CSV file with new content."""
+        """Overwrites CSV file with new content, atomically."""
+
+        def write(f_obj):
+            writer = csv.writer(f_obj, dialect='default')
+            for row in new_content:
+                writer.writerow(row)
+            registry.count('file.bytes_written', f_obj.tell())
+
+        try:
+            self._write_atomic(self.filename, write)
+        except TypeError:
+            log.event(log.ERROR, 'write_error',
+                      '*ERR: TypeError when attempting to write content.',
+                      file=self.filename)
+            return
+
+        self.exists = True
+
+    def append_row(self, row):
+        """Appends a single row to the end of the CSV file."""
+        self.append_rows([row])
+
+    @timed('file.append')
+    def append_rows(self, rows):
+        """Appends several rows to the end of the CSV file in one write."""
 
         try:
-            with open(f'{self.filename}', 'w') as f_obj:
+            with open(self.filename, 'a', encoding='utf-8') as f_obj:
+                start = f_obj.tell() if registry.enabled else 0
                 writer = csv.writer(f_obj, dialect='default')
-                for row in new_content:
-                    writer.writerow(row)
+                writer.writerows(rows)
+                if registry.enabled:
+                    registry.count('file.rows_appended', len(rows))
+                    registry.count('file.bytes_written',
+                                   f_obj.tell() - start)
+                if self.fsync == 'always':
+                    f_obj.flush()
+                    os.fsync(f_obj.fileno())
         except TypeError:
-            print('*ERR: TypeError when attempting to write content.')
+            log.event(log.ERROR, 'write_error',
+                      '*ERR: TypeError when attempting to append rows.',
+                      file=self.filename)
 
         self.exists = True
 
+    def get_stamp(self):
+        """Returns the file's (size, modification time), to spot changes."""
+        stat = os.stat(self.filename)
+        return stat.st_size, stat.st_mtime_ns
+
+    @timed('cache.read')
+    def read_cache(self):
+        """
+        Returns the data saved in the sidecar cache, or None if there is no
+        cache or the CSV file has changed since it was written.
+        """
+        try:
+            with open(self.cache_name, 'rb') as f_obj:
+                version, stamp, payload = marshal.load(f_obj)
+                registry.count('cache.bytes_read', f_obj.tell())
+        except FileNotFoundError:
+            return None
+        except (EOFError, ValueError, TypeError) as err:
+            log.event(log.ERROR, 'cache_error',
+                      "*ERR: %(kind)s when attempting to read cache "
+                      "%(file)s, reading CSV instead:\n\t%(error)s",
+                      kind=type(err).__name__, file=self.cache_name,
+                      error=err)
+            return None
+
+        if version != CACHE_VERSION or stamp != self.get_stamp():
+            return None
+        return payload
+
+    @timed('cache.write')
+    def write_cache(self, payload):
+        """
+        Saves parsed data to the sidecar cache, stamped with the CSV file's
+        current size and modification time.
+
+        :param payload: Plain data, ex from ColumnStore.to_cache
+        """
+        def write(f_obj):
+            marshal.dump((CACHE_VERSION, self.get_stamp(), payload), f_obj)
+            registry.count('cache.bytes_written', f_obj.tell())
+
+        try:
+            self._write_atomic(self.cache_name, write, binary=True,
+                               sync=False)
+        except OSError as err:
+            log.event(log.ERROR, 'cache_error',
+                      "*ERR: %(kind)s when attempting to write cache "
+                      "%(file)s:\n\t%(error)s", kind=type(err).__name__,
+                      file=self.cache_name, error=err)
+
+    def set_aside(self):
+        """
+        Renames the file out of the way, ex a journal that can't be read,
+        so it's kept for inspection but no longer used.
+
+        :return: The file's new name
+        """
+        name = f"{self.filename}.{time.strftime('%Y%m%d-%H%M%S')}.bad"
+        os.replace(self.filename, name)
+        self.exists = False
+        return name
+
     def clear_content(self):
         """Clears the file of content, without deleting the file."""
-        with open(self.filename, 'w') as f_obj:
+        with open(self.filename, 'w', encoding='utf-8') as f_obj:
             f_obj.truncate(0)
 
     def delete_file(self):
@@ -68,33 +307,255 @@ class FileCSV:
         if self.exists:
             os.remove(self.filename)
             self.exists = False
+
+            if os.path.exists(self.cache_name):
+                os.remove(self.cache_name)
         else:
-            print(f"Cannot delete file {self.filename}. It does not exist.")
+            log.event(log.WARNING, 'delete_missing',
+                      "Cannot delete file %(file)s. It does not exist.",
+                      file=self.filename)
+
+
+class BackgroundWriter:
+    """
+    Appends rows to a CSV file from a background thread.
+
+    Rows handed to put() are held until no new row has arrived for delay
+    seconds, then written together in a single append. The thread is only
+    started once there is something to write.
+
+    If a write fails, its rows go back to the front of the queue and the
+    error is kept. Nothing more is written until flush() or close() asks
+    for a retry, and either raises the error if the retry fails too.
+    """
+
+    def __init__(self, file, delay=0.25):
+        """
+        :param file: FileCSV to append rows to
+        :param delay: Quiet period, in seconds, before a burst is written
+        """
+        self.file = file
+        self.delay = delay
+
+        self.pending = []           # Rows waiting to be written
+        self.last_put = 0.0         # time.monotonic() of the latest put
+        self.busy = False           # True while a batch is being written
+        self.flushing = 0           # Number of callers waiting in flush()
+        self.closed = False
+        self.error = None           # Exception from the last failed write
+
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def _start(self):
+        """Starts the thread, or a new one if it died. Hold the lock."""
+        if self.thread is None or not self.thread.is_alive():
+            self.closed = False
+            self.thread = threading.Thread(
+                target=self._run, daemon=True,
+                name=f'writer:{self.file.filename}')
+            self.thread.start()
+
+    def put(self, row):
+        """Queues a row to be appended."""
+        with self.condition:
+            self.pending.append(row)
+            self.last_put = time.monotonic()
+            self._start()
+            self.condition.notify_all()
+
+    def flush(self):
+        """
+        Blocks until every queued row has been written.
+
+        :raise Exception: Whatever the last write failed with, if rows
+         still couldn't be written. They stay queued.
+        """
+        with self.condition:
+            if self.pending:
+                self._start()
+            self.error = None           # Retry anything that failed
+            self.flushing += 1
+            self.condition.notify_all()
+            try:
+                while (self.pending or self.busy) and self.error is None:
+                    self.condition.wait()
+            finally:
+                self.flushing -= 1
+            if self.error is not None:
+                raise self.error
+
+    def discard(self):
+        """Drops every queued row, ex when unsaved changes are discarded."""
+        with self.condition:
+            self.pending = []
+            self.error = None
+            while self.busy:
+                self.condition.wait()
+
+    def close(self):
+        """
+        Writes any queued rows and stops the background thread.
+
+        :raise Exception: Whatever the last write failed with, if rows
+         couldn't be written
+        """
+        with self.condition:
+            self.closed = True
+            self.error = None           # One last try
+            self.condition.notify_all()
+            thread, self.thread = self.thread, None
+
+        if thread is not None:
+            thread.join()
+
+        with self.condition:
+            if self.pending and self.error is not None:
+                raise self.error
+
+    def __getstate__(self):
+        """
+        Pickles everything but the lock and thread, ex so a Ledger can load
+        months in a process pool. Queued rows are written first.
+        """
+        self.flush()
+        state = self.__dict__.copy()
+        del state['condition'], state['thread']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def _run(self):
+        """Background loop: wait for a quiet period, then write a batch."""
+        with self.condition:
+            while True:
+                # After a failed write, wait to be asked to retry
+                while (not self.pending or self.error is not None) \
+                        and not self.closed:
+                    self.condition.wait()
+                if not self.pending or self.error is not None:
+                    return
+
+                # Let a burst settle, unless someone is waiting on us
+                while not self.flushing and not self.closed:
+                    remaining = self.last_put + self.delay - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+
+                # Rows may have been discarded while waiting. Appending
+                # nothing would still create the file.
+                if not self.pending:
+                    continue
+                batch, self.pending = self.pending, []
+                self.busy = True
+                failed = None
+                self.condition.release()
+                try:
+                    self.file.append_rows(batch)
+                except Exception as err:
+                    # Ex a locked database or an unencodable row. Keep
+                    # the rows rather than let the thread die.
+                    log.event(log.ERROR, 'write_error',
+                              "*ERR: %(kind)s when attempting to write "
+                              "%(rows)s row(s) to %(file)s:\n\t%(error)s",
+                              kind=type(err).__name__, rows=len(batch),
+                              file=self.file.filename, error=err)
+                    failed = err
+                finally:
+                    self.condition.acquire()
+                    self.busy = False
+                    if failed is not None:
+                        self.pending[:0] = batch
+                        self.error = failed
+                    self.condition.notify_all()
 
 
 class DirReader:
-    """A class to identify the range of years and months in a directory."""
+    """
+    A class to identify the range of years and months in a directory.
+
+    The directory is scanned once into a sorted catalog of (year, month)
+    pairs, and only scanned again when the directory's modification time
+    changes, ex when a month file is added or removed.
+    """
 
     def __init__ (self, directory):
         self.directory = directory
 
+        self.mtime = None           # Directory mtime at the last scan
+        self.dates = []             # Sorted (year, month) pairs
+        self.by_year = {}           # Year -> sorted list of months
+
     def get_files(self):
         return os.listdir(self.directory)
 
+    def refresh(self):
+        """Rescans the directory, but only if it has changed."""
+        mtime = os.stat(self.directory).st_mtime_ns
+        if mtime == self.mtime:
+            return
+
+        dates = []
+        for name in self.get_files():
+            year, month = name[:4], name[5:7]
+            if (len(name) == 11 and name[4] == '-' and name[7:] == '.csv'
+                    and year.isdigit() and month.isdigit()):
+                dates.append((year, month))
+        self.set_dates(dates)
+        self.mtime = mtime
+
+    def set_dates(self, dates):
+        """Replaces the catalog with a list of (year, month) pairs."""
+        dates = sorted(dates)
+        by_year = {}
+        for year, month in dates:
+            by_year.setdefault(year, []).append(month)
+        self.dates, self.by_year = dates, by_year
+
+    def get_month_files(self):
+        """
+        Returns (year, month) pairs for every YYYY-MM.csv file in the
+        directory, oldest first. Ex: [('2023', '07'), ('2023', '08')]
+        """
+        self.refresh()
+        return list(self.dates)
+
     def get_years(self):
         """Returns list of years found in directory."""
-        years = []
-        for date in self.get_files():
-            if date[:4] not in years:
-                years.append(date[:4])
-        return sorted(years)
+        self.refresh()
+        return list(self.by_year)
 
     def get_months(self, year):
         """Returns list of months for a given year in the directory."""
-        months = []
-        for date in self.get_files():
-            if date[:4] == year and date[8:12] != 'temp':
-                month = int(date[5:7])
-                months.append(calendar.month_name[month])
-        return months
+        return [calendar.month_name[int(month)]
+                for month in self.get_month_numbers(year)]
+
+    def get_month_numbers(self, year):
+        """Returns list of months for a year as strings, ex ['07', '08']."""
+        self.refresh()
+        return list(self.by_year.get(year, []))
+
+    def get_latest(self):
+        """Returns the most recent (year, month) pair, or None if empty."""
+        self.refresh()
+        return self.dates[-1] if self.dates else None
 
+    def get_neighbours(self, year, month):
+        """
+        Returns the (year, month) pairs just before and after a month, or
+        None where there is no such month. The month itself doesn't need
+        to exist in the directory.
+
+        :return: previous, next
+        """
+        self.refresh()
+        date = (year, month)
+        i = bisect_left(self.dates, date)
+        j = i + 1 if i < len(self.dates) and self.dates[i] == date else i
+        previous = self.dates[i - 1] if i > 0 else None
+        following = self.dates[j] if j < len(self.dates) else None
+        return previous, following
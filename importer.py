@@ -0,0 +1,235 @@
+"""
+Bulk import of bank statement CSV files.
+
+Rows stream through three stages, one row at a time:
+- read: each statement file is read with its own column names
+- normalize: a StatementFormat maps the row onto categories.keys and
+  works out which month it belongs to
+- route: rows are grouped by YYYY-MM
+
+Each month is then opened once, gets all of its rows in a single batch
+(one sort-merge into the day index), and is saved once.
+"""
+
+import csv
+from datetime import datetime
+from categories import keys
+import log
+from reader import MonthlyFinances
+from storage import CSVStorage
+from store import from_cents
+from store import parse_cents
+
+
+class StatementFormat:
+    """How the columns of one bank's CSV export map onto categories.keys."""
+
+    def __init__(self, date='Date', company='Description', amount='Amount',
+                 debit=None, credit=None, transaction=None, category=None,
+                 subcategory=None, note=None, date_format='%m/%d/%Y',
+                 charges_positive=False, defaults=None, encoding='utf-8-sig'):
+        """
+        Every column is given by its name in the statement's header row.
+
+        :param date: Column with the transaction date
+        :param company: Column with the payee or description
+        :param amount: Column with a signed amount. Ignored if debit and
+         credit are given.
+        :param debit: Column with money going out, for statements that
+         split amounts into two columns
+        :param credit: Column with money coming in
+        :param transaction: Column with 'Income' or 'Expense'. If None, it's
+         worked out from the amount's sign.
+        :param category: Column with the Category, if the bank has one
+        :param subcategory: Column with the Subcategory
+        :param note: Column to copy into Note, ex a memo or reference
+        :param date_format: strptime format of the date, ex '%Y-%m-%d'
+        :param charges_positive: Statement lists money going out as
+         positive, as most credit card exports do
+        :param defaults: Dict of header name -> value for columns the
+         statement doesn't have, ex {'Category': 'Food'}
+        :param encoding: Encoding of the statement files
+        """
+        self.date = date
+        self.company = company
+        self.amount = amount
+        self.debit = debit
+        self.credit = credit
+        self.transaction = transaction
+        self.category = category
+        self.subcategory = subcategory
+        self.note = note
+        self.date_format = date_format
+        self.charges_positive = charges_positive
+        self.defaults = defaults or {}
+        self.encoding = encoding
+
+    @staticmethod
+    def get(record, column):
+        """
+        Returns a column's value, stripped. Missing columns, and cells
+        missing from short rows, read as ''.
+        """
+        return (record.get(column) or '').strip()
+
+    @staticmethod
+    def require(record, column):
+        """
+        Returns a column's value, stripped.
+
+        :raise ValueError: If the statement has no such column, or the row
+         is too short to have a value for it
+        """
+        if column not in record:
+            raise ValueError(f"no {column!r} column")
+        if record[column] is None:
+            raise ValueError(f"row is missing its {column!r} value")
+        return record[column].strip()
+
+    def get_cents(self, record):
+        """Returns a record's amount in cents, negative for money out."""
+        if self.debit and self.credit:
+            money_in = parse_amount(self.get(record, self.credit))
+            money_out = parse_amount(self.get(record, self.debit))
+            return abs(money_in) - abs(money_out)
+
+        cents = parse_amount(self.require(record, self.amount))
+        return -cents if self.charges_positive else cents
+
+    def normalize(self, record):
+        """
+        Maps a statement record onto categories.keys.
+
+        :param record: Dict of statement column -> value
+        :return: year, month, row. Ex '2023', '08', ['14', 'Big Cafe', ...]
+        :raise ValueError: If a needed column is missing, or the date or
+         amount can't be read
+        """
+        date = datetime.strptime(self.require(record, self.date),
+                                 self.date_format)
+
+        cents = self.get_cents(record)
+        values = dict(self.defaults)
+        values['Day'] = str(date.day)
+        values['Company'] = self.get(record, self.company)
+        values['Amount'] = from_cents(abs(cents))
+
+        if self.transaction:
+            values['Transaction'] = self.require(record,
+                                                 self.transaction)
+        elif 'Transaction' not in values:
+            values['Transaction'] = 'Income' if cents > 0 else 'Expense'
+
+        for name, column in (('Category', self.category),
+                             ('Subcategory', self.subcategory),
+                             ('Note', self.note)):
+            if column:
+                values[name] = self.get(record, column)
+
+        row = [values.get(name, '') for name in keys]
+        return f'{date.year:04}', f'{date.month:02}', row
+
+
+def parse_amount(text):
+    """
+    Converts a statement amount into cents. Accepts currency symbols,
+    thousands separators, and accounting negatives. Ex '($1,234.50)'.
+
+    :raise ValueError: If text isn't an amount
+    """
+    text = text.strip().replace('$', '').replace(',', '')
+    if not text:
+        return 0
+
+    negative = text.startswith('(') and text.endswith(')')
+    if negative:
+        text = text[1:-1]
+
+    cents = parse_cents(text)
+    return -cents if negative else cents
+
+
+class Importer:
+    """Imports bank statements into months of transaction data."""
+
+    def __init__(self, statement_format=None, directory='test_dir',
+                 storage=None, duplicates=None):
+        """
+        :param statement_format: StatementFormat of the files to import.
+         Defaults to Date, Description, and a signed Amount.
+        :param directory: Directory of CSV files, used if storage is None
+        :param storage: Backend to import into, ex a SQLiteStorage
+        :param duplicates: Loaded DuplicateIndex over the same storage.
+         Rows matching ones already stored, or ones from a file imported
+         earlier in the same run, are flagged or rejected. Repeats within
+         a single statement are kept, as the bank lists them separately.
+        """
+        if storage is None:
+            storage = CSVStorage(directory)
+        self.storage = storage
+        self.format = statement_format or StatementFormat()
+        self.duplicates = duplicates
+
+        # (filename, line number, error) for every row that was skipped
+        self.skipped = []
+
+    def read(self, filename):
+        """Yields (line number, record) for each row of a statement."""
+        with open(filename, newline='', encoding=self.format.encoding) \
+                as f_obj:
+            reader = csv.DictReader(f_obj, skipinitialspace=True)
+            for record in reader:
+                yield reader.line_num, record
+
+    def route(self, filenames):
+        """
+        Reads and normalizes statements, grouping rows by month. Rows that
+        can't be read are skipped and recorded in self.skipped.
+
+        :return: Dict of (year, month) -> list of rows
+        """
+        months = {}
+        for filename in filenames:
+            accepted = []
+            for line, record in self.read(filename):
+                try:
+                    year, month, row = self.format.normalize(record)
+                except ValueError as err:
+                    # Bulk imports report skipped rows once, from
+                    # self.skipped
+                    if log.is_enabled(log.DEBUG):
+                        log.event(log.DEBUG, 'import_skipped',
+                                  "ERR: ValueError - %(error)s - when "
+                                  "importing line %(line)s of %(file)s. "
+                                  "Skipped this row.", error=err,
+                                  line=line, file=filename)
+                    self.skipped.append((filename, line, str(err)))
+                    continue
+
+                if self.duplicates is not None and \
+                        not self.duplicates.check(year, month, row):
+                    continue
+                months.setdefault((year, month), []).append(row)
+                accepted.append((year, month, row))
+
+            # Later files are checked against this one too
+            if self.duplicates is not None:
+                for year, month, row in accepted:
+                    self.duplicates.add(year, month, row)
+        return months
+
+    def run(self, filenames):
+        """
+        Imports statement files. Each month they touch is loaded, merged
+        with its new rows, and saved once.
+
+        :param filenames: Paths of statement CSV files
+        :return: Dict of (year, month) -> number of rows imported
+        """
+        imported = {}
+        for (year, month), rows in sorted(self.route(filenames).items()):
+            content = MonthlyFinances(year, month, storage=self.storage)
+            content.add_rows(rows, record=False)
+            content.close_month(save=True)
+            imported[(year, month)] = len(rows)
+        return imported
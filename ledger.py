@@ -0,0 +1,158 @@
+"""
+A read-only view over every month in a transaction directory.
+
+MonthlyFinances only ever holds one month. Ledger discovers every month
+in a storage backend (by default, every YYYY-MM.csv file in a directory)
+and loads them all at once.
+
+Parsing is CPU-bound, so threads don't load months any faster. On a
+machine with several cores, large ledgers are instead parsed in a pool of
+worker processes. Each worker sends back its month's columns as plain
+data (see ColumnStore.to_cache), which is much cheaper to pass between
+processes than a whole MonthlyFinances, along with the metrics it
+recorded, which are merged into this process's registry.
+"""
+
+import os
+from itertools import repeat
+from metrics import registry
+from metrics import timed
+from reader import MonthlyFinances
+from storage import CSVStorage
+from store import ColumnStore
+from summary import Summary
+
+
+# Ledgers with at least this many months load in a process pool by
+# default, if there is more than one CPU. Smaller ones load faster in
+# this process than it takes to start the pool.
+PROCESS_MONTHS = 24
+
+
+def load_month(storage, year, month):
+    """Loads a single month."""
+    return MonthlyFinances(year, month, storage=storage)
+
+
+def load_columns(storage, year, month, metrics=False):
+    """
+    Loads a month's columns in a worker process. Module-level so process
+    pools can pickle it.
+
+    :param metrics: Record metrics, ex because the parent's registry is
+     enabled. The worker's registry is separate from the parent's.
+    :return: Plain data from ColumnStore.to_cache, and the metrics
+     recorded while loading, from Registry.collect, or None
+    """
+    if metrics:
+        # A forked worker starts with a copy of the parent's recordings
+        registry.enable()
+        registry.reset()
+    store, ids = storage.load(year, month)
+    payload = store.to_cache(ids)
+    return payload, registry.collect() if metrics else None
+
+
+class Ledger:
+    """All months of transaction data in a directory or other storage."""
+
+    def __init__(self, directory='test_dir', storage=None):
+        """
+        :param directory: Directory of CSV files, used if storage is None
+        :param storage: Backend to load months from, ex a SQLiteStorage
+        """
+        if storage is None:
+            storage = CSVStorage(directory)
+        self.directory = directory
+        self.storage = storage
+        self.dir_reader = storage.dir_reader
+
+        # (year, month) -> MonthlyFinances, oldest first
+        self.months = {}
+
+    @timed('ledger.load')
+    def load(self, workers=None, processes=None, year=None):
+        """
+        Loads every month found in storage.
+
+        :param workers: Number of worker processes, or None for one per
+         CPU
+        :param processes: Parse months in worker processes. By default,
+         only done for ledgers of PROCESS_MONTHS or more, and only with
+         more than one CPU. Pass False to always load in this process.
+        :param year: Only load months from this year, ex '2023'
+        """
+        dates = [(y, m) for y, m in self.dir_reader.get_month_files()
+                 if year is None or y == year]
+        if processes is None:
+            processes = len(dates) >= PROCESS_MONTHS and \
+                (os.cpu_count() or 1) > 1
+
+        if not processes:
+            self.months = {(y, m): load_month(self.storage, y, m)
+                           for y, m in dates}
+            return self
+
+        # Imported here, as multiprocessing is slow to import and only
+        # needed for process pools
+        from concurrent.futures import ProcessPoolExecutor
+
+        years = [year for year, month in dates]
+        months = [month for year, month in dates]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(load_columns, repeat(self.storage),
+                                   years, months, repeat(registry.enabled),
+                                   chunksize=4)
+            self.months = {}
+            for (y, m), (payload, recorded) in zip(dates, results):
+                if recorded is not None:
+                    registry.merge(*recorded)
+                store = ColumnStore(payload['header'])
+                ids = store.from_cache(payload)
+                self.months[(y, m)] = MonthlyFinances(
+                    y, m, storage=self.storage, loaded=(store, ids))
+
+        return self
+
+    def get_month(self, year, month):
+        """Returns the MonthlyFinances for a month, ex '2023', '08'."""
+        return self.months[(year, month)]
+
+    def get_years(self):
+        """Returns the list of loaded years, oldest first."""
+        return sorted({year for year, month in self.months})
+
+    def select(self, year=None):
+        """
+        Returns the loaded months, oldest first.
+
+        :param year: Only return months from this year, ex '2023'
+        """
+        return [content for (y, m), content in self.months.items()
+                if year is None or y == year]
+
+    def entries(self, year=None):
+        """
+        Yields (year, month, row) for every transaction, in date order.
+
+        :param year: Only yield transactions from this year, ex '2023'
+        """
+        for content in self.select(year):
+            for rid in content.order:
+                yield content.year, content.month, content.get_entry(rid)
+
+    @timed('aggregate.ledger')
+    def summarize(self, year=None):
+        """
+        Returns a Summary of the totals across the loaded months.
+
+        :param year: Only total months from this year, ex '2023'
+        """
+        summary = Summary()
+        for content in self.select(year):
+            summary.add_store(content.store)
+        return summary
+
+    def __len__(self):
+        """Returns the number of transactions across all months."""
+        return sum(len(content.store) for content in self.months.values())
@@ -0,0 +1,189 @@
+"""
+Level-gated event logging.
+
+Each event has a level, a name, and a dict of fields, and its message is
+a template filled from the fields, ex 'Added entry ::  %(row)s'. It's
+only filled in if a handler shows the event.
+
+Two handlers are installed on import:
+- Console prints events at INFO and up, as the program always has
+- RingBuffer keeps the latest events in memory, for dump(), ex after an
+  error
+
+Per-row events, ex every added or removed row, are DEBUG, so by default
+they are never even created: callers check is_enabled(DEBUG) first. Call
+set_level(DEBUG) to keep them, or set_level(DEBUG, show=True) to print
+them too.
+
+Levels are the standard logging module's numbers, but the module itself
+isn't used: with traceback and the rest it pulls in, it cost every
+command-line run more to import than the commands took to start.
+
+Ex:
+    if log.is_enabled(log.DEBUG):
+        log.event(log.DEBUG, 'insert', "Added entry ::  %(row)s",
+                  row=row)
+"""
+
+import sys
+import time
+from collections import deque
+
+
+# Levels, as in the logging module
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING',
+               ERROR: 'ERROR'}
+
+# Number of events the ring buffer keeps
+CAPACITY = 1000
+
+
+class Event:
+    """A recorded event. Its message is only filled in when asked for."""
+
+    __slots__ = ('created', 'level', 'name', 'message', 'fields')
+
+    def __init__(self, level, name, message, fields):
+        self.created = time.time()
+        self.level = level
+        self.name = name
+        self.message = message
+        self.fields = fields
+
+    @property
+    def level_name(self):
+        return LEVEL_NAMES.get(self.level, f"Level {self.level}")
+
+    def get_message(self):
+        """Returns the message filled from the fields, if there are any."""
+        # Without fields, the message is printed as it is, so a '%' in it
+        # is left alone
+        if self.fields:
+            return self.message % self.fields
+        return self.message
+
+
+class Console:
+    """Prints the message of each event at its level and up."""
+
+    def __init__(self, level=INFO):
+        self.level = level
+        self.file = None            # File to print to, stdout if None
+
+    def emit(self, record):
+        try:
+            message = record.get_message()
+        except (TypeError, ValueError, KeyError) as err:
+            print(f"ERR: {type(err).__name__} - {err} - when formatting "
+                  f"event {record.name!r}", file=sys.stderr)
+            return
+        print(message, file=self.file)
+
+
+class RingBuffer:
+    """Holds the latest events, dropping the oldest once full."""
+
+    def __init__(self, capacity=CAPACITY):
+        self.records = deque(maxlen=capacity)
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def clear(self):
+        self.records.clear()
+
+    def events(self):
+        """Returns the held events as dicts, oldest first."""
+        return [as_dict(record) for record in list(self.records)]
+
+
+def as_dict(record):
+    """Returns an event as a dict of its time, level, name, and fields."""
+    return {
+        'time': record.created,
+        'level': record.level_name,
+        'event': record.name,
+        **record.fields,
+    }
+
+
+console = Console(INFO)
+ring = RingBuffer()
+
+# Lowest level recorded
+level = INFO
+
+
+def is_enabled(event_level):
+    """Returns True if events at event_level are recorded."""
+    return event_level >= level
+
+
+def set_level(new_level, show=False):
+    """
+    Sets the lowest level of event recorded, ex DEBUG to record every row
+    change.
+
+    :param show: Print events from new_level up as well. Otherwise events
+     below INFO are only kept in the ring buffer.
+    """
+    global level
+    level = new_level
+    console.level = min(new_level, INFO) if show else INFO
+
+
+def set_output(file):
+    """
+    Prints events to file, ex sys.stderr when stdout carries a command's
+    output. None prints to stdout.
+    """
+    console.file = file
+
+
+def event(event_level, name, message, **fields):
+    """
+    Records an event.
+
+    :param event_level: Ex INFO
+    :param name: Name of the event, ex 'insert'
+    :param message: Template filled from fields, ex 'Added %(row)s'
+    :param fields: Values that describe the event
+    """
+    if event_level < level:
+        return
+    record = Event(event_level, name, message, fields)
+    ring.emit(record)
+    if event_level >= console.level:
+        console.emit(record)
+
+
+def recent():
+    """Returns the events in the ring buffer, oldest first."""
+    return ring.events()
+
+
+def dump(file=None, count=None):
+    """
+    Writes the events in the ring buffer, oldest first, ex to stderr once
+    something has gone wrong.
+
+    :param file: File to write to, stdout if None
+    :param count: Only write this many of the latest events
+    """
+    records = list(ring.records)
+    if count is not None:
+        records = records[-count:]
+
+    print(f"Last {len(records)} event(s):", file=file)
+    for record in records:
+        stamp = time.strftime('%H:%M:%S', time.localtime(record.created))
+        try:
+            message = record.get_message()
+        except (TypeError, ValueError, KeyError):
+            message = record.message
+        print(f"{stamp} {record.level_name:<7} {message}", file=file)
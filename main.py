@@ -17,14 +17,28 @@ TODO:
 
 """
 
+import sys
+import traceback
 import tkinter as tk
 import tkinter.font as tkFont
+from tkinter import messagebox
 from tkinter import ttk
 from datetime import datetime
 from calendar import monthrange
+import log
+import metrics
+from duplicates import DuplicateIndex
 from reader import MonthlyFinances
-from file_handler import DirReader
+from search import SearchIndex
+from storage import CSVStorage
+from store import from_cents
+from store import parse_cents
 from categories import categories as cats
+from virtual_tree import VirtualTree
+
+
+# Months with more rows than this are shown with virtual scrolling
+VIRTUAL_ROWS = 1000
 
 
 def month_to_num(m):
@@ -46,7 +60,23 @@ def get_day_list(year, month):
 
 class App:
 
-    def __init__(self, master):
+    def __init__(self, master, storage=None):
+        """
+        :param master: Root Tk window
+        :param storage: Where months are kept, ex a SQLiteStorage.
+         Defaults to the CSV files in test_dir.
+        """
+        # Months are found, loaded, and saved through this
+        self.storage = storage or CSVStorage('test_dir')
+
+        # Flags new entries that match one already in any month
+        self.duplicates = DuplicateIndex(self.storage)
+
+        # Company and Note search, kept current with the open month's
+        # edits. Only CSV directories can be indexed.
+        self.search = None
+        if isinstance(self.storage, CSVStorage):
+            self.search = SearchIndex(self.storage.directory).load()
 
         # Default to the current year and month
         date_now = datetime.now()
@@ -59,6 +89,7 @@ class App:
 
         # Initialize empty variables
         self.content = None         # Content to fill treeview
+        self.tree_cols = None       # Content columns shown in the treeview
         self.drop_month = None      # Tk options menu widget
         self.selected_year = None   # Tk var for currently selected year
         self.selected_month = None  # Tk var for currently selected month
@@ -76,6 +107,14 @@ class App:
         self.master.geometry(alignstr)
         self.master.resizable(width=False, height=False)
 
+        # Errors in button and menu commands come with recent events
+        self.master.report_callback_exception = self.report_error
+
+    def report_error(self, exc, value, tb):
+        """Prints the latest logged events, then a callback's error."""
+        log.dump(sys.stderr, count=50)
+        traceback.print_exception(exc, value, tb)
+
     def build_gui(self):
         """Build all the main app GUI elements."""
 
@@ -101,8 +140,11 @@ class App:
 
     def dismiss(self, save=False):
 
-        if save:
-            self.content.commit_changes()
+        # Waits for the journal writer before the window goes away
+        self.content.close_month(save=save)
+        if self.search is not None:
+            self.search.unwatch(self.content)
+            self.search.save()
         self.master.destroy()
 
     def update_logic(self, init=False, new_transaction=False):
@@ -111,7 +153,21 @@ class App:
         if new_transaction is False:
             if init is False:
                 self.content.close_month()
-            self.content = MonthlyFinances(self.year, self.month_num)
+                self.duplicates.unwatch(self.content)
+                if self.search is not None:
+                    self.search.unwatch(self.content)
+
+            # Pick up months saved since, including the one just closed
+            self.duplicates.refresh()
+            self.content = MonthlyFinances(self.year, self.month_num,
+                                           storage=self.storage,
+                                           duplicates=self.duplicates)
+            if self.search is not None:
+                self.search.refresh()
+                self.search.watch(self.content)
+
+            # Keep the treeview in step with each edit from now on
+            self.content.subscribe(self.on_content_change)
 
         if init:
             self.init = True
@@ -123,50 +179,77 @@ class App:
         self.update_tree()
         self.init = False
 
-    def update_tree(self, new_transaction=False):
+    def update_tree(self):
         """
-        Update the treeview widget. Call this function whenever the year or
-         month changes, or when transaction data is edited.
-        :param new_transaction: True when data is updated but no month change
+        Rebuild the treeview widget from scratch. Only needed when the year
+         or month changes; edits are applied by on_content_change.
         """
 
+        # Get column index for headers we care about.
+        # TODO: Create settings file that includes header preferences.
+        self.tree_cols = [self.content.get_header_index(name) for name in
+                          ('Day', 'Company', 'Subcategory', 'Amount')]
+
+        # Large months only materialize the rows in view
+        if len(self.content.order) > VIRTUAL_ROWS:
+            self.view.attach(lambda: len(self.content.order),
+                             self.fetch_tree_rows)
+            return
+        self.view.detach()
+
         # First clear the treeview of content
         self.tree.delete(*self.tree.get_children())
 
-        # Get column index for headers we care about.
-        # TODO: Create settings file that includes header preferences.
-        c0 = self.content.get_header_index('Day')
-        c1 = self.content.get_header_index('Company')
-        c2 = self.content.get_header_index('Subcategory')
-        c3 = self.content.get_header_index('Amount')
+        # Fill the treeview data, row by row, using row IDs as item IDs
+        for rid in self.content.order:
+            self.tree.insert(parent='', index='end', iid=str(rid), text='',
+                             values=self.tree_values(rid))
+
+    def tree_values(self, rid):
+        """Returns the values the treeview shows for a row ID."""
+        row = self.content.get_entry(rid)
+        return [row[c] for c in self.tree_cols]
 
-        # Fill the treeview data, row by row
-        for row in range(1, self.content.length):
+    def fetch_tree_rows(self, start, stop):
+        """Returns (iid, values) for rows start to stop, for self.view."""
+        return [(str(rid), self.tree_values(rid))
+                for rid in self.content.order[start:stop]]
 
-            # First fetch the data at each column for a given row
-            col0 = self.content.get_value(row, c0)
-            col1 = self.content.get_value(row, c1)
-            col2 = self.content.get_value(row, c2)
-            col3 = self.content.get_value(row, c3)
+    def on_content_change(self, event, rid, index):
+        """
+        Applies a single change in self.content to the treeview, instead of
+         rebuilding it. See MonthlyFinances.subscribe.
+        """
+        # With virtual scrolling, only the rows in view need redrawing
+        if self.view.active:
+            self.view.refresh()
+            return
 
-            # Arrange and format the data
-            text = [f"{col0}", f"{col1}", f"{col2}", f"{col3}"]
+        iid = str(rid)
 
-            # Then insert the data in the treeview
-            self.tree.insert(parent='', index=row, text='', values=text)
+        if event == 'update' and self.tree.index(iid) == index:
+            self.tree.item(iid, values=self.tree_values(rid))
+            return
+
+        # A changed day moves the row, so take it out and put it back
+        if event in ('update', 'delete'):
+            self.tree.delete(iid)
+        if event in ('insert', 'update'):
+            self.tree.insert(parent='', index=index, iid=iid, text='',
+                             values=self.tree_values(rid))
 
     def get_selection(self):
         """
         Returns info about the user's current selection in the treeview.
 
         - iid: Tkinter internal ID for a treeview item
-        - index: The item's position in the treeview
+        - rid: The row ID of the selected transaction, or None
 
-        :return: iid, index
+        :return: iid, rid
         """
         iid = self.tree.focus()                 # Internal ID
-        index = self.tree.index(iid) + 1        # Index
-        return iid, index
+        rid = int(iid) if iid else None         # Item IDs are row IDs
+        return iid, rid
 
     def update_year_list(self):
         """
@@ -176,7 +259,7 @@ class App:
         """
 
         # Get updated list of available years based
-        year_list = path.get_years()
+        year_list = self.storage.get_years()
 
         # Clear current dropdown menu contents
         menu = self.drop_year['menu']
@@ -197,7 +280,7 @@ class App:
         """
 
         # Get updated list of available months based on selected year
-        month_list = path.get_months(self.year)
+        month_list = self.storage.get_months(self.year)
 
         # Clear current dropdown menu contents
         menu = self.drop_month["menu"]
@@ -229,6 +312,9 @@ class App:
         self.tree.configure(yscrollcommand=tree_scroll.set)
         tree_scroll.pack(side=tk.RIGHT, fill=tk.BOTH)
 
+        # Takes over the scroll bar for months too large to fill in full
+        self.view = VirtualTree(self.tree, tree_scroll)
+
         self.tree.column("#0", width=0, stretch=tk.NO)
         self.tree.column('Day', anchor=tk.W, width=35)
         self.tree.column('Company', anchor=tk.W, width=170)
@@ -254,6 +340,56 @@ class App:
                               command=lambda: self.dismiss(save=True))
         menubar.add_cascade(label='File', menu=file_menu, underline=0)
 
+        # Metrics recorded by the data layer, see metrics.py
+        self.record_metrics = tk.BooleanVar(value=metrics.registry.enabled)
+        debug_menu = tk.Menu(menubar, tearoff=False)
+        debug_menu.add_checkbutton(
+            label='Record Metrics', variable=self.record_metrics,
+            command=lambda: metrics.registry.enable(
+                self.record_metrics.get()))
+        debug_menu.add_command(label='Show Metrics',
+                               command=lambda: self.show_metrics())
+        debug_menu.add_command(label='Reset Metrics',
+                               command=lambda: metrics.registry.reset())
+        debug_menu.add_separator()
+
+        # Row changes are DEBUG events, see log.py
+        self.log_rows = tk.BooleanVar(value=log.is_enabled(log.DEBUG))
+        debug_menu.add_checkbutton(
+            label='Log Every Change', variable=self.log_rows,
+            command=lambda: log.set_level(
+                log.DEBUG if self.log_rows.get() else log.INFO))
+        debug_menu.add_command(label='Show Recent Events',
+                               command=lambda: self.show_events())
+        menubar.add_cascade(label='Debug', menu=debug_menu, underline=0)
+
+    def show_text(self, title, content):
+        """Opens a read-only window of monospaced text."""
+        popup = tk.Toplevel(self.master)
+        popup.title(title)
+        text = tk.Text(popup, width=90, height=30, wrap=tk.NONE,
+                       font=tkFont.Font(family='Courier', size=10))
+        text.insert(tk.END, content)
+        text.config(state=tk.DISABLED)
+        text.pack(fill=tk.BOTH, expand=True)
+
+    def show_events(self):
+        """Opens a window with the events in the log's ring buffer."""
+        lines = []
+        for event in log.recent():
+            stamp = datetime.fromtimestamp(event.pop('time'))
+            lines.append(f"{stamp:%H:%M:%S} {event.pop('level'):<7} "
+                         f"{event.pop('event')}  {event}")
+        self.show_text('Recent Events', '\n'.join(lines))
+
+    def show_metrics(self):
+        """Opens a window with the metrics recorded so far."""
+        content = metrics.registry.report()
+        if not metrics.registry.enabled:
+            content += ('\n\nRecording is off. Turn it on under '
+                        'Debug > Record Metrics.')
+        self.show_text('Metrics', content)
+
     def _create_btn_income(self):
         """"""
         def btn_income_command():
@@ -290,11 +426,12 @@ class App:
         """"""
         def btn_edit_command():
             """"""
-            iid, index = self.get_selection()
+            iid, rid = self.get_selection()
 
             if iid:
-                edit_row = self.content.data[index]
-                PopUpTransaction(self.master, existing_values=edit_row)
+                edit_row = self.content.get_entry(rid)
+                PopUpTransaction(self.master, existing_values=edit_row,
+                                 row_id=rid)
 
         # Create edit button
         btn_edit = tk.Button(self.master)
@@ -314,12 +451,12 @@ class App:
             """Delete selected data, if any."""
 
             # Get info about current user selection
-            iid, index = self.get_selection()
+            iid, rid = self.get_selection()
 
-            # Delete line from treeview and CSV if one is selected
+            # Delete line from the data if one is selected. The treeview
+            # item is removed by on_content_change.
             if iid:
-                self.tree.delete(iid)           # Tree view
-                self.content.del_row(index)     # CSV file
+                self.content.del_row(rid)
 
         # Create delete button
         btn_del = tk.Button(self.master)
@@ -373,7 +510,7 @@ class App:
                 self.update_month_list()
 
         # Get the list of available years based on files in directory
-        year_list = path.get_years()
+        year_list = self.storage.get_years()
 
         # Create and set TK string variable for selected year
         self.selected_year = tk.StringVar()
@@ -402,7 +539,7 @@ class App:
                 self.update_logic()
 
         # Get the list of available months based on selected year
-        month_list = path.get_months(self.year)
+        month_list = self.storage.get_months(self.year)
 
         # Create and set TK string variable for selected month
         self.selected_month = tk.StringVar()
@@ -442,10 +579,12 @@ class App:
 
 class PopUpTransaction:
 
-    def __init__(self, parent, existing_values=None, transaction='Expense'):
+    def __init__(self, parent, existing_values=None, transaction='Expense',
+                 row_id=None):
 
         # Determines default values and close-out behavior
         self.existing_values = existing_values
+        self.row_id = row_id            # Row ID of the entry being edited
 
         # Serves as the top-level menu for categories and subcategories
         self.transaction_type = transaction             # May not be needed
@@ -522,8 +661,8 @@ class PopUpTransaction:
         :param update: Set to True if entries in the popup fields should be
         saved, or False to simply close the popup window.
         """
-        if update:
-            self.save_fields()
+        if update and not self.save_fields():
+            return              # Leave the popup open to fix the entry
 
         # Release the main GUI window and destroy the popup
         self.popup.grab_release()
@@ -532,8 +671,19 @@ class PopUpTransaction:
     def save_fields(self):
         """
         Send out user-entered values.
-        TODO: Some kind of data validation for the entry boxes.
+        TODO: Some kind of data validation for the other entry boxes.
+
+        :return: False if nothing was sent, ex the amount can't be read or
+         the entry duplicates one the user chose not to add again
         """
+        # Check the amount once here, and write it the way it's stored,
+        # ex '12.5' -> '12.50'
+        try:
+            amount = from_cents(parse_cents(self.amount_var.get()))
+        except ValueError as err:
+            print(f"ValueError ::  {err}  :: Enter an amount like 383.59")
+            return False
+
         # Gather all user-set values into a list
         # Conveniently this is already in a CSV friendly format
         entry = [self.selected_day.get(),
@@ -541,19 +691,34 @@ class PopUpTransaction:
                  self.selected_type.get(),
                  self.selected_cat.get(),
                  self.selected_subcat.get(),
-                 self.amount_var.get(),
+                 amount,
                  self.note_var.get()]
 
         # If popup was prompted as part of an edit, replace the entry
         if self.existing_values:
-            app.content.replace_row(self.existing_values, entry)
+            app.content.replace_row(self.row_id, entry)
 
-        # Otherwise, insert the new entry
+        # Otherwise, insert the new entry, checking it isn't already there
         else:
-            app.content.add_row(entry)
-
-        # Update content in the main GUI's treeview
-        app.update_tree(new_transaction=True)
+            content = app.content
+            matches = app.duplicates.find(content.year, content.month, entry,
+                                          content.columns)
+            if matches and not messagebox.askyesno(
+                    'Possible duplicate',
+                    f"{entry[1]} for {amount} matches entries on "
+                    f"{', '.join(matches)}.\n\nAdd it anyway?",
+                    parent=self.popup):
+                return False
+
+            if content.add_row(entry) is None:
+                messagebox.showerror(
+                    'Duplicate rejected',
+                    'Duplicate entries are rejected, so this one was not '
+                    'added.', parent=self.popup)
+                return False
+
+        # The main GUI's treeview updates itself through on_content_change
+        return True
 
     def build_gui(self):
         """Assemble of the popup's GUI elements"""
@@ -1085,10 +1250,6 @@ class PopUpNewMonth:
         self.popup.bind('<Return>', lambda event=None: self.btn_save.invoke())
 
 
-# Set default file directory
-path = DirReader('C:/Create/Code/projects/finances/test_dir')
-
-
 if __name__ == "__main__":
     root = tk.Tk()          # Create root TK window
     app = App(root)         # Initialize GUI with root as parent
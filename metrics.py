@@ -0,0 +1,192 @@
+"""
+In-process metrics for the data layer.
+
+Timings go into histograms and sizes (rows, bytes) into counters, all in
+a single Registry. Recording is off by default. While it's off, a timed
+function only pays for one attribute check, and callers guard anything
+costlier with `if registry.enabled`.
+
+Ex:
+    import metrics
+    metrics.registry.enable()
+    ...
+    print(metrics.registry.report())
+"""
+
+from bisect import bisect_left
+from functools import wraps
+import threading
+import time
+
+
+# Upper bounds of the histogram buckets, in seconds: 1us, 2us, 4us, ...
+# up to about 17 minutes. Anything slower goes in a last, open bucket.
+BOUNDS = [1e-6 * 2 ** i for i in range(31)]
+
+
+class Histogram:
+    """Distribution of timings, in power-of-two buckets."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(BOUNDS) + 1)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+        self.buckets[bisect_left(BOUNDS, seconds)] += 1
+
+    def merge(self, other):
+        """Adds another histogram's timings to this one."""
+        if not other.count:
+            return
+        self.count += other.count
+        self.total += other.total
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+
+    def percentile(self, p):
+        """
+        Returns an upper bound on the p-th percentile, ex p=95, from the
+        buckets, or None if nothing was observed.
+        """
+        if not self.count:
+            return None
+        rank = self.count * p / 100
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return min(BOUNDS[i], self.max) if i < len(BOUNDS) \
+                    else self.max
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'max': self.max,
+        }
+
+
+class Registry:
+    """Named timing histograms and counters."""
+
+    def __init__(self):
+        self.enabled = False
+        self.timers = {}            # Name -> Histogram
+        self.counters = {}          # Name -> total, ex rows or bytes
+
+        # Journals are written from a background thread, so updates are
+        # made under a lock. Months loaded in worker processes record into
+        # each worker's own registry, see collect and merge.
+        self.lock = threading.Lock()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def reset(self):
+        """Forgets everything recorded so far."""
+        with self.lock:
+            self.timers = {}
+            self.counters = {}
+
+    def observe(self, name, seconds):
+        """Records a timing, in seconds."""
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = Histogram()
+            timer.observe(seconds)
+
+    def count(self, name, amount=1):
+        """Adds to a counter, ex count('file.bytes_read', 2048)."""
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def collect(self):
+        """
+        Returns the histograms and counters recorded so far, and forgets
+        them, ex to send from a worker process to merge().
+        """
+        with self.lock:
+            timers, counters = self.timers, self.counters
+            self.timers = {}
+            self.counters = {}
+        return timers, counters
+
+    def merge(self, timers, counters):
+        """Adds histograms and counters returned by collect()."""
+        with self.lock:
+            for name, other in timers.items():
+                timer = self.timers.get(name)
+                if timer is None:
+                    timer = self.timers[name] = Histogram()
+                timer.merge(other)
+            for name, amount in counters.items():
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self):
+        """Returns everything recorded as plain data, ex to dump as JSON."""
+        with self.lock:
+            return {
+                'timers': {name: timer.as_dict()
+                           for name, timer in sorted(self.timers.items())},
+                'counters': dict(sorted(self.counters.items())),
+            }
+
+    def report(self):
+        """Returns everything recorded as a text table."""
+        snapshot = self.snapshot()
+        lines = [f"{'timer':<28}{'count':>8}{'total ms':>11}"
+                 f"{'mean us':>11}{'p95 us':>11}{'max us':>11}"]
+        for name, stats in snapshot['timers'].items():
+            lines.append(f"{name:<28}{stats['count']:>8}"
+                         f"{stats['total'] * 1e3:>11.2f}"
+                         f"{stats['mean'] * 1e6:>11.1f}"
+                         f"{stats['p95'] * 1e6:>11.1f}"
+                         f"{stats['max'] * 1e6:>11.1f}")
+        if snapshot['counters']:
+            lines.append('')
+            lines.append(f"{'counter':<28}{'total':>14}")
+            for name, total in snapshot['counters'].items():
+                lines.append(f"{name:<28}{total:>14}")
+        return '\n'.join(lines)
+
+
+# The registry everything records to
+registry = Registry()
+
+
+def timed(name):
+    """
+    Decorator that records how long each call takes under a name, while
+    the registry is enabled.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not registry.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
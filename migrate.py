@@ -0,0 +1,58 @@
+"""
+Copies every month from one storage backend to another. Ex, to move a
+directory of CSV files into a SQLite database:
+
+    python migrate.py test_dir finances.db
+
+A path ending in .db, .sqlite, or .sqlite3 is a SQLite database, and any
+other path is a directory of CSV files. Unsaved changes left behind in a
+month's journal are copied too, though the journal itself is not.
+"""
+
+import argparse
+import os
+from reader import MonthlyFinances
+from storage import CSVStorage
+from storage import open_storage
+
+
+def migrate(source, target):
+    """
+    Copies every month from one backend to another, replacing any month
+    the target already has.
+
+    :param source: Backend to read months from, ex a CSVStorage
+    :param target: Backend to save months to, ex a SQLiteStorage
+    :return: Number of months copied. Months the target can't hold, ex
+     with amounts that can't be read, are reported and left out.
+    """
+    copied = 0
+    for year, month in source.get_month_files():
+        content = MonthlyFinances(year, month, storage=source)
+        try:
+            target.save(year, month, content.store, content.order)
+            copied += 1
+        except ValueError as err:
+            print(f"ERR: ValueError - {err} - Skipped this month.")
+        content.writer.close()
+    return copied
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Copy every month from one storage backend to another.')
+    parser.add_argument('source', help='CSV directory or SQLite database')
+    parser.add_argument('target', help='CSV directory or SQLite database')
+    args = parser.parse_args(args)
+
+    source = open_storage(args.source)
+    target = open_storage(args.target)
+    if isinstance(target, CSVStorage):
+        os.makedirs(target.directory, exist_ok=True)
+
+    count = migrate(source, target)
+    print(f"Copied {count} month(s) from {args.source} to {args.target}")
+
+
+if __name__ == '__main__':
+    main()
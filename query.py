@@ -0,0 +1,221 @@
+"""
+Filtering, projecting, and ordering transactions across months.
+
+A Query pushes its filters down as far as it can:
+- Month files outside the date range are never opened
+- With SQLiteStorage, months without a matching saved row are found with
+  the database's indexes and never loaded
+- Days are narrowed with the month's DayIndex instead of scanning
+- Transaction, Category, and Subcategory are compared as interned codes,
+  and a month where a wanted value never occurs is skipped outright
+- Company is matched exactly, so SQLiteStorage can use its index on it
+- Amounts are compared as integer cents
+"""
+
+from datetime import date as datetime_date
+from itertools import compress
+from reader import MonthlyFinances
+from storage import CSVStorage
+from storage import Storage
+from store import CodeColumn
+from store import KeyPart
+from store import parse_cents
+
+
+def as_set(value):
+    """Turns None, a string, or a collection of strings into a set or None."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return {value}
+    return set(value)
+
+
+def split_date(date, low):
+    """
+    Splits 'YYYY[-MM[-DD]]' into a (year, month, day) tuple, filling
+    missing parts with the lowest or highest value. Year and month are
+    zero-padded strings, as month files are named, ex ('2023', '08', 5).
+
+    :raise ValueError: If date isn't a valid date, or part of one
+    """
+    if date is None:
+        return None
+    parts = date.split('-')
+    if not 1 <= len(parts) <= 3 or len(parts[0]) != 4 \
+            or not all(part.isdecimal() for part in parts):
+        raise ValueError(f"invalid date: {date!r}, expected YYYY[-MM[-DD]]")
+
+    year = int(parts[0])
+    month = int(parts[1]) if len(parts) > 1 else (1 if low else 12)
+    day = int(parts[2]) if len(parts) > 2 else None
+    try:
+        # Checks the month, and the day against the month's length
+        datetime_date(year, month, day or 1)
+    except ValueError as err:
+        raise ValueError(f"invalid date: {date!r}, {err}") from None
+
+    if day is None:
+        day = 1 if low else 31
+    return f'{year:04}', f'{month:02}', day
+
+
+class Query:
+    """A reusable set of filters over transaction data."""
+
+    def __init__(self, transaction=None, category=None, subcategory=None,
+                 start=None, end=None, min_amount=None, max_amount=None,
+                 columns=None, order_by=None, descending=False,
+                 company=None):
+        """
+        Every filter is optional, and all given filters must match.
+
+        :param transaction: Type or collection of types, ex 'Expense'
+        :param category: Category or collection of categories
+        :param subcategory: Subcategory or collection of subcategories
+        :param company: Company or collection of companies, matched
+         exactly, ex 'Amazon'
+        :param start: First date to include, ex '2023-08-10' or '2023-08'
+        :param end: Last date to include, ex '2023-09-05' or '2023'
+        :param min_amount: Smallest amount to include, ex '10.00'
+        :param max_amount: Largest amount to include, ex '250'
+        :param columns: Header names to return, ex ['Day', 'Amount'].
+         Defaults to every column.
+        :param order_by: Header name to sort on. Defaults to date order.
+        :param descending: Sort from largest to smallest
+        :raise ValueError: If start or end isn't a date, or min_amount or
+         max_amount isn't an amount
+        """
+        self.filters = {
+            'Transaction': as_set(transaction),
+            'Category': as_set(category),
+            'Subcategory': as_set(subcategory),
+            'Company': as_set(company),
+        }
+        self.start = split_date(start, low=True)
+        self.end = split_date(end, low=False)
+        self.min_cents = None
+        if min_amount is not None:
+            self.min_cents = parse_cents(str(min_amount))
+        self.max_cents = None
+        if max_amount is not None:
+            self.max_cents = parse_cents(str(max_amount))
+        self.columns = columns
+        self.order_by = order_by
+        self.descending = descending
+
+    def wants_month(self, year, month):
+        """Returns False if the date range rules out a whole month."""
+        if self.start and (year, month) < self.start[:2]:
+            return False
+        if self.end and (year, month) > self.end[:2]:
+            return False
+        return True
+
+    def match(self, content):
+        """
+        Returns the IDs of the rows in a MonthlyFinances that pass every
+        filter, in date order.
+        """
+        store = content.store
+        date = (content.year, content.month)
+
+        # Narrow by day using the day index, only in the boundary months
+        first = self.start[2] if self.start and self.start[:2] == date else 1
+        last = self.end[2] if self.end and self.end[:2] == date else 31
+        if first > 1 or last < 31:
+            rids = content.day_range(first, last)
+        else:
+            rids = content.order
+
+        # Compare interned codes rather than strings, or for Company the
+        # text itself. A column knows codes for values no live row has,
+        # ex every taxonomy leaf, so only the codes in use count.
+        for name, wanted in self.filters.items():
+            if wanted is None:
+                continue
+            col = store.column(name)
+            values = col.values
+            codes = col.matching(wanted)
+            if codes:
+                codes &= set(compress(values, store.alive))
+            if not codes:
+                return []           # Value never occurs in this month
+            rids = [rid for rid in rids if values[rid] in codes]
+
+        # Compare amounts as integer cents
+        amounts = store.column('Amount').values
+        if self.min_cents is not None:
+            rids = [rid for rid in rids if amounts[rid] >= self.min_cents]
+        if self.max_cents is not None:
+            rids = [rid for rid in rids if amounts[rid] <= self.max_cents]
+
+        return list(rids)
+
+    def months(self, source):
+        """
+        Yields the MonthlyFinances the query needs to look at.
+
+        :param source: A loaded Ledger, or a storage backend or directory
+         path to read months from one at a time
+        """
+        if isinstance(source, str):
+            source = CSVStorage(source)
+
+        if isinstance(source, Storage):
+            candidates = None
+            if hasattr(source, 'matching_months'):
+                candidates = source.matching_months(
+                    self.filters, self.min_cents, self.max_cents)
+            for year, month in source.get_month_files():
+                if candidates is not None and \
+                        (year, month) not in candidates:
+                    continue
+                if self.wants_month(year, month):
+                    yield MonthlyFinances(year, month, storage=source)
+        else:
+            for (year, month), content in source.months.items():
+                if self.wants_month(year, month):
+                    yield content
+
+    def run(self, source='test_dir'):
+        """
+        Runs the query.
+
+        :param source: A loaded Ledger, a storage backend, or a directory
+         path
+        :return: List of [year, month, *values] rows, with values as
+         strings for the requested columns
+        """
+        results = []                # (sort key, row)
+        for content in self.months(source):
+            header = content.store.header
+            cols = [content.columns[name] for name in self.columns or header]
+            sort_col = self._sort_column(content)
+
+            for rid in self.match(content):
+                values = [content.store.get_value(rid, c) for c in cols]
+                key = sort_col[rid] if sort_col is not None else None
+                results.append((key, [content.year, content.month, *values]))
+
+        # Rows are already in date order, so only sort when asked to
+        if self.order_by is not None:
+            results.sort(key=lambda result: result[0],
+                         reverse=self.descending)
+        elif self.descending:
+            results.reverse()
+
+        return [row for key, row in results]
+
+    def _sort_column(self, content):
+        """Returns a sequence of sort keys indexed by row ID, or None."""
+        if self.order_by is None:
+            return None
+
+        col = content.store.column(self.order_by)
+        if self.order_by == 'Day':
+            # Days only sort correctly alongside their year and month
+            return [(content.year, content.month, day) for day in col.values]
+        if isinstance(col, (CodeColumn, KeyPart)):
+            return [col.format(code) for code in col.values]
+        return col.values
@@ -1,152 +1,436 @@
 """
 Program flow:
-- Create or read original file (perm file), set initial data state
-- Copy data from perm file to a temporary working file
-- Changes should modify temp file only
-- Save button or exiting program commits changes to perm file
-
-TODO: It's questionable that a temp file is needed at all. Could just work
- from within self.data.
+- Load the month from storage (perm file), set initial data state
+- Replay the journal, if one was left behind by a crash
+- Each change is applied to self.store and appended to the journal
+- Save button or exiting program commits changes to storage and
+  deletes the journal
+
+Storage is a CSV directory by default, see storage.py for the backends.
+
+Messages go through log.py. Those for single rows are DEBUG events, only
+created when that level is on, so bulk edits don't pay for console output.
+
+Journal records are lists of the form:
+- ['@', *stamp]         First record: storage stamp of the saved month the
+                        journal applies to. If the month has been saved
+                        since, the journal was already committed.
+- ['+', index, *row]    Row inserted at display position index
+- ['=', index, *row]    Row at display position index replaced
+- ['-', index]          Row at display position index removed
 """
 
-from file_handler import FileCSV
-import json
-from categories import categories
-from categories import keys
+from file_handler import BackgroundWriter
+import log
+from metrics import registry
+from metrics import timed
+from store import DayIndex
+from storage import CSVStorage
+from summary import Summary
 
 
 class MonthlyFinances:
-    def __init__(self, year, month):
+    @timed('month.open')
+    def __init__(self, year, month, directory='test_dir', fsync='save',
+                 storage=None, duplicates=None, loaded=None):
+        """
+        :param year: Ex '2023'
+        :param month: Ex '08'
+        :param directory: Directory of CSV files, used if storage is None
+        :param fsync: One of FSYNC_POLICIES, used if storage is None
+        :param storage: Backend to load and save the month with, ex a
+         SQLiteStorage. Defaults to CSVStorage(directory, fsync).
+        :param duplicates: DuplicateIndex that add_row checks new rows
+         against. It follows this month's edits from then on.
+        :param loaded: ColumnStore and row IDs already loaded from
+         storage, ex by a Ledger worker process, to use instead of loading
+        """
+        self.year = year            # Ex: '2023'
+        self.month = month          # Ex: '08'
+
+        if storage is None:
+            storage = CSVStorage(directory, fsync)
+        self.storage = storage
+
+        # Name of the month in messages, ex 'test_dir/2023-08'
+        self.path = storage.describe(year, month)
+
+        # Load the month into columns, creating it if it doesn't exist.
+        # Each row gets a stable ID, and the day index keeps the IDs in
+        # display order.
+        self.store, ids = loaded or storage.load(year, month)
+
+        self.index = DayIndex(self.store.column('Day').values)
+        self.index.build(ids)
 
-        # Create file path based on provided date
-        self.path = f'test_dir/{year}-{month}'
+        # Running totals, kept up to date by every add, replace, and delete
+        self.totals = Summary().add_store(self.store)
+        self.tally_cols = [self.store.column(name) for name in
+                           ('Transaction', 'Category', 'Subcategory')]
+        self.key = self.store.key
+        self.amounts = self.store.column('Amount').values
 
-        # Open permanent file object
-        self.perm_file = FileCSV(f'{self.path}.csv')
+        # Header name -> column index, resolved once
+        self.columns = self.store.columns
 
-        # If perm CSV file doesn't already exist, create it
-        if self.perm_file.exists is False:
-            self.perm_file.write_content([keys])        # Write header line
-            print(f"Created perm file :: {self.path}")
+        # Open journal and replay any changes left over from a crash
+        self.journal = storage.open_journal(year, month)
+        self.journal_started = False
+        if self.journal.exists:
+            self.replay_journal()
 
-        # Get perm file contents
-        self.data = self.perm_file.get_content()
+        # Journal records are written off the caller's thread, in bursts
+        self.writer = BackgroundWriter(self.journal)
 
-        # Create temporary working file and copy contents to it
-        self.temp_file = FileCSV(f'{self.path}-temp.csv')
-        self.temp_file.write_content(self.data)
-        print(f"Copied contents to temp file ::  {f'{self.path}-temp.csv'}")
+        # Functions to call after each add, replace, or delete
+        self.listeners = []
 
         # Used by App class to determine read range
         self.length = self.get_length()
 
+        self.duplicates = duplicates
+        if duplicates is not None:
+            duplicates.watch(self)
+
+    def replay_journal(self):
+        """Applies every record in the journal file to the data."""
+        records = self.journal.get_content()
+        if records is None:
+            # Unreadable, ex wrong encoding. Keep it rather than let the
+            # next save delete it along with the changes it holds.
+            name = self.journal.set_aside()
+            log.event(log.ERROR, 'journal_unreadable',
+                      "ERR: Could not read journal, no changes were "
+                      "recovered. Moved it to ::  %(journal)s",
+                      journal=name)
+            return
+        applied = 0
+
+        # A crash between saving and deleting the journal leaves a journal
+        # whose changes are already saved
+        if records and records[0][0] == '@':
+            base = [int(x) for x in records.pop(0)[1:]]
+            if base != list(self.get_stamp()):
+                log.event(log.WARNING, 'journal_stale',
+                          "Journal predates the last save, discarding ::  "
+                          "%(journal)s", journal=self.journal.filename)
+                self.journal.delete_file()
+                return
+        self.journal_started = True
+
+        for record in records:
+            try:
+                self._apply(record)
+            except (ValueError, IndexError) as err:
+                # A crash mid-write can leave a partial last record
+                log.event(log.ERROR, 'journal_error',
+                          "ERR: %(error)s - %(detail)s - when replaying "
+                          "journal record %(record)d of %(records)d. "
+                          "Stopped replay at this record.",
+                          error=type(err).__name__, detail=str(err),
+                          record=applied + 1, records=len(records))
+                break
+            applied += 1
+
+        log.event(log.INFO, 'journal_replayed',
+                  "Recovered %(applied)d unsaved change(s) from journal ::  "
+                  "%(journal)s", applied=applied,
+                  journal=self.journal.filename)
+
+    def _apply(self, record):
+        """
+        Applies a single journal record to the data.
+
+        Records refer to rows by display position rather than ID, because
+        IDs are only assigned in memory and can differ after a reload.
+
+        :param record: Journal record, see module docstring for the format
+        """
+        op, index, row = record[0], int(record[1]), record[2:]
+
+        if op == '+':
+            self._insert(row)       # Position follows from the day
+        elif op == '=':
+            self._replace(self.order[index], row)
+        elif op == '-':
+            self._delete(self.order[index])
+        else:
+            raise ValueError(f"unknown journal operation {op!r}")
+
+    def _record(self, record):
+        """Queues an applied change to be appended to the journal."""
+        if not self.journal_started:
+            self.writer.put(['@', *self.get_stamp()])
+            self.journal_started = True
+        self.writer.put(record)
+        self.length = self.get_length()
+
+    def get_stamp(self):
+        """Returns the storage stamp of the saved month."""
+        return self.storage.get_stamp(self.year, self.month)
+
+    def subscribe(self, listener):
+        """
+        Registers a function to be told about every change to the data.
+
+        :param listener: Called as listener(event, rid, index), where event
+         is 'insert', 'update', or 'delete', rid is the row ID, and index
+         is the row's display position (its new one, for an update, or its
+         old one, for a delete)
+        """
+        self.listeners.append(listener)
+
+    def _notify(self, event, rid, index):
+        for listener in self.listeners:
+            listener(event, rid, index)
+
+    def _tally(self, rid, sign):
+        """Adds (sign=1) or removes (sign=-1) a row from the totals."""
+        if self.key is not None:
+            keys = self.key.strings[self.key.values[rid]]
+        else:
+            keys = [col.get_text(rid) for col in self.tally_cols]
+        self.totals.add(*keys, sign * self.amounts[rid])
+
+    def _insert(self, row):
+        """Stores a new row and returns its ID and display position."""
+        rid = self.store.append_row(row)
+        self._tally(rid, 1)
+        return rid, self.index.add(rid)
+
+    def _replace(self, rid, row):
+        """Overwrites a row in place and returns the old one."""
+        days = self.store.column('Day').values
+        old_day = days[rid]
+        old = self.store.get_row(rid)
+        self._tally(rid, -1)
+        self.store.set_row(rid, row)
+        self._tally(rid, 1)
+
+        # Only a change of day moves the row in the display order
+        if days[rid] != old_day:
+            self.index.remove(rid)
+            self.index.add(rid)
+
+        return old
+
+    def _delete(self, rid):
+        """Marks a row as deleted and returns it."""
+        self.index.remove(rid)
+        self._tally(rid, -1)
+        return self.store.delete_row(rid)
+
+    @property
+    def order(self):
+        """Row IDs in display order, sorted by day."""
+        return self.index.order
+
     def get_length(self):
-        try:
-            return len(self.data)
-        except TypeError as err:
-            print(f"ERR: TypeError - {err} - "
-                  f"when attempting to measure CSV file length")
-            pass
+        """Returns the number of rows, counting the header row."""
+        return len(self.store) + 1
 
     def get_header_index(self, n):
         """
         Returns a string's index in the CSV data's header row.
 
-        TODO: Handle exceptions when no matching string is found.
-
         :param n: string to be found in CSV header row
-        :return: string's index in the header row
+        :return: string's index in the header row, or None if not found
         """
         try:
-            return self.data[0].index(n.strip())
-        except IndexError as err:
-            print(f"ERR: IndexError - {err} - "
-                  f"when attempting to get index of a header. "
-                  f"self.data is {self.data}")
-        except TypeError as err:
-            print(f"ERR: TypeError - {err} - "
-                  f"when attempting to get index of a header. "
-                  f"self.data is {self.data}")
+            return self.columns[n.strip()]
+        except KeyError as err:
+            log.event(log.ERROR, 'unknown_header',
+                      "ERR: KeyError - %(header)r - when attempting to get "
+                      "index of a header. Header is %(headers)s",
+                      header=n, headers=self.store.header)
+
+    def rows(self):
+        """Yields every row, header first, as a list of strings."""
+        yield self.store.header
+        for rid in self.order:
+            yield self.store.get_row(rid)
+
+    def position(self, rid):
+        """Returns a row ID's display position, not counting the header."""
+        return self.index.position(rid)
+
+    def day_range(self, first, last):
+        """
+        Returns the IDs of rows between two days, inclusive, in display
+        order. Ex: day_range(10, 20) for the 10th through the 20th.
+        """
+        return self.index.day_range(first, last)
 
     def get_row(self, i, listed=True):
-        """Return a row, formatted as requested."""
+        """Return a row, formatted as requested. Row 0 is the header."""
+        if i == 0:
+            row = self.store.header
+        else:
+            row = self.store.get_row(self.order[i - 1])
+
         if listed:
-            return self.data[i]
+            return row
         else:
-            return ','.join(self.data[i])
+            return ','.join(row)
+
+    def get_entry(self, rid):
+        """Returns the row with a given ID as a list of strings."""
+        return self.store.get_row(rid)
 
     def get_value(self, r, c):
         """
 
-        :param r: row
+        :param r: row (row 0 is the header)
         :param c: column
         :return: value at the intersection of r and c
         """
-        return self.data[r][c]
+        if r == 0:
+            return self.store.header[c]
+        return self.store.get_value(self.order[r - 1], c)
 
+    @timed('month.add_row')
     def add_row(self, row):
-        """Add a row to the data."""
-
-        new_day = int(row[0])       # Day of data entry (as an integer)
-        index = self.length         # Default insertion index (end of list)
-
-        # Loop through the data, except header row
-        for i, r in enumerate(self.data[1:], start=1):
-
-            # Set insertion index to 1 before next found date in the data
-            if int(r[0]) > new_day:
-                index = i
-                break
-
-        # Insert the data and update the working file
-        self.data.insert(index, row)
-        self.temp_file.write_content(self.data)
-        print(f"Added entry ::  {row}  :: to {self.path}-temp")
-
-    def replace_row(self, old, new):
-        """Replace a row with a new one."""
-        index = self.data.index(old)
-        self.data[index] = new
-        print(f"Replaced entry ::  {old}  :: New entry ::  {new}")
+        """
+        Add a row to the data and log it to the journal.
 
-    def del_row(self, i):
-        """Remove a line from the data and then rewrite the file."""
-        removed = self.data.pop(i)
-        self.temp_file.write_content(self.data)
-        print(f'Removed entry ::  {removed}  :: from {self.path}')
+        :return: ID of the new row, or None if it was rejected as a
+         duplicate
+        """
+        if self.duplicates is not None and \
+                not self.duplicates.check(self.year, self.month, row,
+                                          self.columns):
+            return None
+
+        rid, index = self._insert(row)
+        self._record(['+', index, *row])
+        self._notify('insert', rid, index)
+        if log.is_enabled(log.DEBUG):
+            log.event(log.DEBUG, 'insert',
+                      "Added entry ::  %(row)s  :: to %(path)s",
+                      row=row, path=self.path, rid=rid, index=index)
+        return rid
+
+    @timed('month.add_rows')
+    def add_rows(self, rows, record=True):
+        """
+        Adds many rows in one batch, ex from an import. The rows are
+        merged into the day index together rather than placed one by one.
 
-    def close_month(self):
+        :param rows: Rows as lists of strings
+        :param record: Log the rows to the journal. Pass False when the
+         month is saved straight after, as the importer does.
+        :return: IDs of the new rows, in display order
+        """
+        ids = self.store.load(rows)
+        for rid in ids:
+            self._tally(rid, 1)
+        ids, positions = self.index.extend(ids)
+
+        for rid, index in zip(ids, positions):
+            if record:
+                self._record(['+', index, *self.store.get_row(rid)])
+            self._notify('insert', rid, index)
+        self.length = self.get_length()
+        registry.count('month.rows_added', len(ids))
+
+        log.event(log.INFO, 'insert_many',
+                  "Added %(count)d entries  :: to %(path)s",
+                  count=len(ids), path=self.path)
+        return ids
+
+    @timed('month.replace_row')
+    def replace_row(self, rid, new):
+        """Replace the row with a given ID with a new one."""
+        index = self.position(rid)
+        old = self._replace(rid, new)
+        self._record(['=', index, *new])
+        self._notify('update', rid, self.position(rid))
+        if log.is_enabled(log.DEBUG):
+            log.event(log.DEBUG, 'update',
+                      "Replaced entry ::  %(old)s  :: New entry ::  %(new)s",
+                      old=old, new=new, path=self.path, rid=rid)
+
+    @timed('month.del_row')
+    def del_row(self, rid):
+        """Remove the row with a given ID and log it to the journal."""
+        index = self.position(rid)
+        removed = self._delete(rid)
+        self._record(['-', index])
+        self._notify('delete', rid, index)
+        if log.is_enabled(log.DEBUG):
+            log.event(log.DEBUG, 'delete',
+                      "Removed entry ::  %(row)s  :: from %(path)s",
+                      row=removed, path=self.path, rid=rid, index=index)
+
+    def flush(self):
+        """Blocks until every change so far is written to the journal."""
+        self.writer.flush()
+
+    def close_month(self, save=True):
+        """
+        Saves or discards changes, then stops the journal writer.
 
-        self.commit_changes()
-        self.temp_file.delete_file()
+        :param save: Commit changes to the perm file, or drop them
+        """
+        if save:
+            self.commit_changes()
+        else:
+            self.discard_changes()
+        self.writer.close()
 
+    @timed('month.commit')
     def commit_changes(self):
-        self.perm_file.write_content(self.data)
-        print(f"Changes saved to permanent file ::  {self.path}.csv")
+        """Compacts the journal into storage."""
+        self.flush()
+        self.storage.save(self.year, self.month, self.store, self.order)
+        log.event(log.INFO, 'commit',
+                  "Changes saved to permanent file ::  %(path)s",
+                  path=self.path, rows=len(self.store))
+
+        # Journal is now reflected in storage
+        if self.journal.exists:
+            self.journal.delete_file()
+        self.journal_started = False
+
+    def discard_changes(self):
+        """Drops all unsaved changes by deleting the journal."""
+        self.writer.discard()
+        self.journal_started = False
+        if self.journal.exists:
+            self.journal.delete_file()
+            log.event(log.INFO, 'discard',
+                      "Discarded unsaved changes ::  %(journal)s",
+                      journal=self.journal.filename)
+
+    def summarize(self):
+        """Returns this month's running totals, without recalculating."""
+        return self.totals
+
+    @timed('aggregate.check_totals')
+    def check_totals(self):
+        """
+        Recalculates this month's totals from scratch and compares them
+        with the running totals.
+
+        :return: True if the running totals are correct
+        """
+        fresh = Summary().add_store(self.store)
+        if fresh != self.totals:
+            log.event(log.ERROR, 'totals_mismatch',
+                      "ERR: Running totals for %(path)s don't match a "
+                      "fresh recalculation", path=self.path)
+            return False
+        return True
 
     def simple_readout(self):
         """Puts out a simple terminal printout of the transaction data."""
-        all_transactions = categories       # Dictionary to fill with data
+        summary = self.summarize()
 
-        # Iterate over each row of data, except first row
-        for row in self.data[1:]:
-            # Keys to populate the dictionary
-            trans, cat, sub = row[2], row[3], row[4]
+        # Report each unrecognized set of keys once
+        for trans, cat, sub in summary.unknown:
+            print(f"KeyError ::  {trans} / {cat} / {sub}  :: not recognized")
 
-            # Get transaction amount for current row
-            try:
-                amount = round(float(row[5]), 2)
-            except ValueError as err:
-                print(f"ValueError ::  {err}  :: Check CSV for name errors.")
-                amount = 0.00
-
-            # Tally transaction amounts for each subcategory
-            try:
-                all_transactions[trans][cat][sub] += amount
-            except KeyError as err:
-                print(
-                    f"KeyError ::  {trans} type {err} not recognized")
-                pass
-
-        # Terminal printout of the dictionary
-        print(json.dumps(all_transactions, indent=4))
+        # Terminal printout of the totals
+        import json
+        print(json.dumps(summary.as_dict(), indent=4))
+        return summary
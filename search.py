@@ -0,0 +1,276 @@
+"""
+Full-text search over the Company and Note fields of every month.
+
+SearchIndex keeps an inverted index of token -> month -> row IDs, saved to
+a file, by default search.index in the transaction directory. On refresh, only months whose CSV
+file has changed since they were indexed are read again. A month that is
+open for editing is indexed from its MonthlyFinances instead, and kept up
+to date through MonthlyFinances.subscribe.
+
+Row IDs are the ones MonthlyFinances assigns: for a month open for
+editing, those of the open instance, and otherwise those of a fresh load
+(ie, the row's position in the CSV file).
+"""
+
+import marshal
+import os
+import re
+from bisect import bisect_left
+from file_handler import DirReader
+from file_handler import FileCSV
+from file_handler import write_atomic
+import log
+
+
+# Bump whenever the layout of the saved index changes
+INDEX_VERSION = 1
+
+# Fields that are searchable
+FIELDS = ('Company', 'Note')
+
+TOKEN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """Splits text into a set of lowercase words, ex 'Big Cafe' -> big, cafe"""
+    return set(TOKEN.findall(text.lower()))
+
+
+class SearchIndex:
+    """An inverted index over Company and Note, across every month."""
+
+    def __init__(self, directory='test_dir', filename=None):
+        """
+        :param directory: Directory of CSV files to index
+        :param filename: Where the index is saved, ex outside a directory
+         that is synced or backed up. Defaults to search.index in the
+         directory, which DirReader doesn't take for a month.
+        """
+        self.directory = directory
+        self.dir_reader = DirReader(directory)
+        self.filename = filename or os.path.join(directory, 'search.index')
+
+        self.postings = {}          # token -> {month key: set of row IDs}
+        self.month_tokens = {}      # month key -> set of tokens in it
+        self.stamps = {}            # month key -> CSV (size, mtime)
+
+        # Months open for editing: month key -> {row ID: tokens}
+        self.live = {}
+
+        self.vocab = []             # Sorted tokens, for prefix queries
+        self.vocab_dirty = False
+
+    # Building the index
+
+    def load(self):
+        """Reads the saved index, if any, then indexes changed months."""
+        try:
+            with open(self.filename, 'rb') as f_obj:
+                version, months = marshal.load(f_obj)
+        except FileNotFoundError:
+            months = {}
+        except (EOFError, ValueError, TypeError) as err:
+            log.event(log.ERROR, 'index_error',
+                      "*ERR: %(kind)s when attempting to read %(file)s, "
+                      "rebuilding it:\n\t%(error)s",
+                      kind=type(err).__name__, file=self.filename,
+                      error=err)
+            months = {}
+        else:
+            if version != INDEX_VERSION:
+                months = {}
+
+        for key, (stamp, tokens) in months.items():
+            self._add_month(key, {token: set(rids)
+                                  for token, rids in tokens.items()})
+            self.stamps[key] = tuple(stamp)
+
+        self.refresh()
+        return self
+
+    def save(self):
+        """
+        Writes the index to its file, atomically. Months that are or were
+        open for editing are left out, since their row IDs may not match
+        the file on disk. They're read from file again on the next
+        refresh.
+        """
+        months = {}
+        for key, stamp in self.stamps.items():
+            if key in self.live or stamp is None:
+                continue
+            tokens = {token: sorted(self.postings[token][key])
+                      for token in self.month_tokens.get(key, ())}
+            months[key] = (stamp, tokens)
+
+        def write(f_obj):
+            marshal.dump((INDEX_VERSION, months), f_obj)
+
+        # The index can always be rebuilt, so it isn't synced
+        try:
+            write_atomic(self.filename, write, binary=True)
+        except OSError as err:
+            log.event(log.ERROR, 'index_error',
+                      "*ERR: %(kind)s when attempting to write %(file)s:"
+                      "\n\t%(error)s", kind=type(err).__name__,
+                      file=self.filename, error=err)
+
+    def refresh(self):
+        """Indexes new or changed month files and drops deleted ones."""
+        found = set()
+        for year, month in self.dir_reader.get_month_files():
+            key = f'{year}-{month}'
+            found.add(key)
+            if key in self.live:
+                continue
+
+            perm_file = FileCSV(os.path.join(self.directory, f'{key}.csv'))
+            stamp = perm_file.get_stamp()
+            if self.stamps.get(key) != stamp:
+                self._index_file(key, perm_file)
+                self.stamps[key] = stamp
+
+        for key in set(self.stamps) - found:
+            self._drop_month(key)
+            del self.stamps[key]
+
+    def _index_file(self, key, perm_file):
+        """Indexes a month straight from its CSV file."""
+        rows = perm_file.iter_rows()
+        header = next(rows, [])
+        cols = [header.index(field) for field in FIELDS if field in header]
+
+        tokens = {}
+        for rid, row in enumerate(rows):
+            for token in tokenize(' '.join(row[c] for c in cols
+                                           if c < len(row))):
+                tokens.setdefault(token, set()).add(rid)
+
+        self._drop_month(key)
+        self._add_month(key, tokens)
+
+    def _add_month(self, key, tokens):
+        """Adds a month's token -> row IDs postings to the index."""
+        for token, rids in tokens.items():
+            months = self.postings.get(token)
+            if months is None:
+                months = self.postings[token] = {}
+                self.vocab_dirty = True
+            months[key] = rids
+        self.month_tokens[key] = set(tokens)
+
+    def _drop_month(self, key):
+        """Removes every posting for a month."""
+        for token in self.month_tokens.pop(key, ()):
+            months = self.postings[token]
+            del months[key]
+            if not months:
+                del self.postings[token]
+                self.vocab_dirty = True
+
+    # Keeping an open month up to date
+
+    def _row_tokens(self, content, rid):
+        row = content.get_entry(rid)
+        return tokenize(' '.join(row[content.columns[field]]
+                                 for field in FIELDS
+                                 if field in content.columns))
+
+    def _add_row(self, key, rid, tokens):
+        self.live[key][rid] = tokens
+        self.month_tokens.setdefault(key, set()).update(tokens)
+        for token in tokens:
+            months = self.postings.get(token)
+            if months is None:
+                months = self.postings[token] = {}
+                self.vocab_dirty = True
+            months.setdefault(key, set()).add(rid)
+
+    def _remove_row(self, key, rid):
+        for token in self.live[key].pop(rid):
+            months = self.postings[token]
+            rids = months[key]
+            rids.discard(rid)
+            if not rids:
+                del months[key]
+                self.month_tokens[key].discard(token)
+                if not months:
+                    del self.postings[token]
+                    self.vocab_dirty = True
+
+    def watch(self, content):
+        """
+        Indexes an open MonthlyFinances and follows its edits.
+
+        :param content: MonthlyFinances open for editing
+        """
+        key = f'{content.year}-{content.month}'
+        self._drop_month(key)
+        self.live[key] = {}
+        for rid in content.order:
+            self._add_row(key, rid, self._row_tokens(content, rid))
+
+        # Recorded as changed, so it's read from file once no longer open
+        self.stamps[key] = None
+
+        def listener(event, rid, index):
+            if key not in self.live:
+                return
+            if event in ('update', 'delete'):
+                self._remove_row(key, rid)
+            if event in ('insert', 'update'):
+                self._add_row(key, rid, self._row_tokens(content, rid))
+
+        content.subscribe(listener)
+
+    def unwatch(self, content):
+        """Stops following a MonthlyFinances, ex once it's closed."""
+        self.live.pop(f'{content.year}-{content.month}', None)
+
+    # Queries
+
+    def _expand(self, term):
+        """Returns the tokens a query term matches. 'caf*' is a prefix."""
+        if not term.endswith('*'):
+            return [term] if term in self.postings else []
+
+        if self.vocab_dirty:
+            self.vocab = sorted(self.postings)
+            self.vocab_dirty = False
+
+        prefix = term[:-1]
+        matches = []
+        for token in self.vocab[bisect_left(self.vocab, prefix):]:
+            if not token.startswith(prefix):
+                break
+            matches.append(token)
+        return matches
+
+    def search(self, query):
+        """
+        Finds transactions whose Company or Note contains every term of a
+        query. A term ending in '*' matches any word starting with it.
+        Ex: search('amazon book*')
+
+        :return: Sorted list of (year, month, row ID)
+        """
+        # Split into words the same way as the indexed text
+        terms = []
+        for term in query.lower().split():
+            words = TOKEN.findall(term)
+            if words and term.endswith('*'):
+                words[-1] += '*'
+            terms.extend(words)
+
+        hits = None
+        for term in terms:
+            term_hits = set()
+            for token in self._expand(term):
+                for key, rids in self.postings[token].items():
+                    term_hits.update((key, rid) for rid in rids)
+
+            hits = term_hits if hits is None else hits & term_hits
+            if not hits:
+                return []
+
+        return sorted((key[:4], key[5:], rid) for key, rid in hits or ())
@@ -0,0 +1,455 @@
+"""
+Where months of transaction data are kept.
+
+MonthlyFinances doesn't read or write files itself. It asks a storage
+backend to load a month into a ColumnStore, to save it back, and for a
+journal to record unsaved changes in. Two backends are available:
+- CSVStorage: a directory with one YYYY-MM.csv file per month, each with
+  a binary cache and, while it has unsaved changes, a journal file
+- SQLiteStorage: a single database file holding every month, indexed by
+  date, category, and company, where saving a month is one transaction
+
+Both find their months the same way, through a DirReader-style catalog:
+get_month_files, get_years, get_months, get_month_numbers, get_latest.
+"""
+
+import threading
+from categories import keys
+from file_handler import DirReader
+from file_handler import FileCSV
+from file_handler import FSYNC_POLICIES
+import log
+from metrics import registry
+from metrics import timed
+from store import ColumnStore
+from summary import Summary
+
+
+# File extensions that open_storage treats as a SQLite database
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+
+
+def open_storage(path, fsync='save'):
+    """
+    Returns the backend for a path: SQLiteStorage for a database file, ex
+    'finances.db', or CSVStorage for a directory, ex 'test_dir'.
+    """
+    if path.endswith(SQLITE_EXTENSIONS):
+        return SQLiteStorage(path, fsync)
+    return CSVStorage(path, fsync)
+
+
+class Storage:
+    """
+    Shared by every backend. Month discovery goes through self.dir_reader,
+    which each backend sets to a DirReader for where its months are.
+    """
+
+    dir_reader = None
+
+    def get_month_files(self):
+        """Returns (year, month) pairs for every stored month, oldest first."""
+        return self.dir_reader.get_month_files()
+
+    def get_years(self):
+        """Returns list of years with stored months."""
+        return self.dir_reader.get_years()
+
+    def get_months(self, year):
+        """Returns list of month names stored for a year."""
+        return self.dir_reader.get_months(year)
+
+    def get_month_numbers(self, year):
+        """Returns list of months for a year as strings, ex ['07', '08']."""
+        return self.dir_reader.get_month_numbers(year)
+
+    def get_latest(self):
+        """Returns the most recent (year, month) pair, or None if empty."""
+        return self.dir_reader.get_latest()
+
+
+class CSVStorage(Storage):
+    """Months kept as YYYY-MM.csv files in a directory."""
+
+    def __init__(self, directory='test_dir', fsync='save'):
+        """
+        :param directory: Directory holding the month files
+        :param fsync: One of FSYNC_POLICIES, see FileCSV
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {FSYNC_POLICIES}, "
+                             f"not {fsync!r}")
+
+        self.directory = directory
+        self.fsync = fsync
+        self.dir_reader = DirReader(directory)
+
+    def describe(self, year, month):
+        """Returns a name for a month, used in messages."""
+        return f'{self.directory}/{year}-{month}'
+
+    def get_file(self, year, month):
+        """Returns the FileCSV holding a month."""
+        return FileCSV(f'{self.describe(year, month)}.csv', self.fsync)
+
+    @timed('storage.load')
+    def load(self, year, month):
+        """
+        Loads a month into columns, creating an empty month if there is
+        none. Uses the binary cache if it's fresh, or else streams the CSV.
+
+        :return: ColumnStore, and the IDs of its rows in saved order
+        """
+        perm_file = self.get_file(year, month)
+        if perm_file.exists is False:
+            perm_file.write_content([keys])             # Write header line
+            log.event(log.INFO, 'month_created',
+                      "Created perm file :: %(month)s",
+                      month=self.describe(year, month))
+
+        cache = perm_file.read_cache()
+        if cache:
+            store = ColumnStore(cache['header'])
+            ids = store.from_cache(cache)
+            registry.count('storage.rows_loaded', len(ids))
+            return store, ids
+
+        content = perm_file.iter_rows()
+        store = ColumnStore(next(content))
+        ids = store.load(content)
+        perm_file.write_cache(store.to_cache(ids))
+        registry.count('storage.rows_loaded', len(ids))
+        return store, ids
+
+    @timed('storage.save')
+    def save(self, year, month, store, ids):
+        """
+        Replaces a month's file with these rows, and refreshes its cache.
+
+        :param store: ColumnStore holding the rows
+        :param ids: IDs of the rows to save, in order
+        """
+        perm_file = self.get_file(year, month)
+        header = [store.header]
+        perm_file.write_content(
+            header + [store.get_row(rid) for rid in ids])
+        perm_file.write_cache(store.to_cache(ids))
+        registry.count('storage.rows_saved', len(ids))
+
+    def get_stamp(self, year, month):
+        """Returns a value that changes every time a month is saved."""
+        return self.get_file(year, month).get_stamp()
+
+    def open_journal(self, year, month):
+        """Returns the FileCSV that records a month's unsaved changes."""
+        return FileCSV(f'{self.describe(year, month)}-journal.csv',
+                       self.fsync)
+
+
+class TableReader(DirReader):
+    """A DirReader whose catalog is the months table of a database."""
+
+    def __init__(self, storage):
+        super().__init__(storage.filename)
+        self.storage = storage
+
+    def get_files(self):
+        return [f'{year}-{month}' for year, month in self.storage.months()]
+
+    def refresh(self):
+        """Reads the catalog again. The table is small and indexed."""
+        self.set_dates(self.storage.months())
+
+
+class SQLiteJournal:
+    """
+    The unsaved changes of one month, kept in the database's journal
+    table. Has the parts of FileCSV's interface that MonthlyFinances and
+    BackgroundWriter use.
+    """
+
+    def __init__(self, storage, year, month):
+        self.storage = storage
+        self.year = year
+        self.month = month
+        self.filename = f'{storage.describe(year, month)}-journal'
+
+    @property
+    def exists(self):
+        """True if the month has journal records."""
+        return self.storage.execute(
+            'SELECT 1 FROM journal WHERE year = ? AND month = ? LIMIT 1',
+            (self.year, self.month)).fetchone() is not None
+
+    def get_content(self):
+        """Returns the journal records, oldest first, as lists."""
+        import json
+        cursor = self.storage.execute(
+            'SELECT record FROM journal WHERE year = ? AND month = ? '
+            'ORDER BY id', (self.year, self.month))
+        return [json.loads(record) for record, in cursor]
+
+    def append_rows(self, rows):
+        """Appends several records in one transaction."""
+        import json
+        with self.storage.connect() as conn:
+            conn.executemany(
+                'INSERT INTO journal (year, month, record) VALUES (?, ?, ?)',
+                [(self.year, self.month, json.dumps(row)) for row in rows])
+
+    def append_row(self, row):
+        self.append_rows([row])
+
+    def delete_file(self):
+        """Deletes every journal record for the month."""
+        with self.storage.connect() as conn:
+            conn.execute('DELETE FROM journal WHERE year = ? AND month = ?',
+                         (self.year, self.month))
+
+
+class SQLiteStorage(Storage):
+    """
+    Every month in one SQLite database file.
+
+    Rows are stored with typed values (Day as an integer, Amount as integer
+    cents) in the transactions table, keyed by (year, month, position) and
+    indexed by date and category. Only the columns in categories.keys are
+    stored. Each thread gets its own connection.
+
+    Months are still edited and queried in memory, through
+    MonthlyFinances. The category index lets a Query find which months
+    can match before loading any, see matching_months.
+    """
+
+    # SQLite synchronous setting for each fsync policy
+    SYNCHRONOUS = {'never': 'OFF', 'save': 'NORMAL', 'always': 'FULL'}
+
+    # Column types, and the value a missing column is stored as
+    TYPES = {'Day': 'INTEGER', 'Amount': 'INTEGER'}
+    DEFAULTS = {'Day': 0, 'Amount': 0}
+
+    def __init__(self, filename='finances.db', fsync='save'):
+        """
+        Opens the database, creating its tables if needed.
+
+        :param filename: Path of the database file
+        :param fsync: One of FSYNC_POLICIES, mapped to SQLite's synchronous
+         setting
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {FSYNC_POLICIES}, "
+                             f"not {fsync!r}")
+
+        self.filename = filename
+        self.fsync = fsync
+        self.local = threading.local()
+        self.dir_reader = TableReader(self)
+
+        columns = ', '.join(f'"{name}" {self.TYPES.get(name, "TEXT")}'
+                            for name in keys)
+        with self.connect() as conn:
+            conn.executescript(f'''
+                CREATE TABLE IF NOT EXISTS months (
+                    year TEXT NOT NULL,
+                    month TEXT NOT NULL,
+                    version INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (year, month));
+                CREATE TABLE IF NOT EXISTS transactions (
+                    year TEXT NOT NULL,
+                    month TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    {columns},
+                    PRIMARY KEY (year, month, position)) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS transactions_date
+                    ON transactions (year, month, "Day");
+                CREATE INDEX IF NOT EXISTS transactions_category
+                    ON transactions ("Category", "Subcategory");
+                CREATE INDEX IF NOT EXISTS transactions_company
+                    ON transactions ("Company");
+                CREATE TABLE IF NOT EXISTS journal (
+                    id INTEGER PRIMARY KEY,
+                    year TEXT NOT NULL,
+                    month TEXT NOT NULL,
+                    record TEXT NOT NULL);
+                CREATE INDEX IF NOT EXISTS journal_month
+                    ON journal (year, month, id);
+            ''')
+
+        names = ', '.join(f'"{name}"' for name in keys)
+        self.select_sql = (f'SELECT {names} FROM transactions '
+                           f'WHERE year = ? AND month = ? ORDER BY position')
+        self.insert_sql = (f'INSERT INTO transactions '
+                           f'(year, month, position, {names}) '
+                           f'VALUES (?, ?, ?{", ?" * len(keys)})')
+
+    def __getstate__(self):
+        """Pickles everything but the connections, ex for process pools."""
+        state = self.__dict__.copy()
+        del state['local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.local = threading.local()
+
+    def connect(self):
+        """Returns this thread's connection, opening it if needed."""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            # Imported here, so CSV directories don't pay for it
+            import sqlite3
+            conn = sqlite3.connect(self.filename, timeout=30)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute(f'PRAGMA synchronous = '
+                         f'{self.SYNCHRONOUS[self.fsync]}')
+            self.local.conn = conn
+        return conn
+
+    def execute(self, sql, parameters=()):
+        """Runs a read-only statement and returns its cursor."""
+        return self.connect().execute(sql, parameters)
+
+    def close(self):
+        """Closes this thread's connection."""
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+    def months(self):
+        """Returns every stored (year, month) pair, oldest first."""
+        return self.execute('SELECT year, month FROM months '
+                            'ORDER BY year, month').fetchall()
+
+    def describe(self, year, month):
+        """Returns a name for a month, used in messages."""
+        return f'{self.filename}:{year}-{month}'
+
+    @timed('storage.load')
+    def load(self, year, month):
+        """
+        Loads a month into columns, creating an empty month if there is
+        none.
+
+        :return: ColumnStore, and the IDs of its rows in saved order
+        """
+        with self.connect() as conn:
+            created = conn.execute(
+                'INSERT OR IGNORE INTO months (year, month) VALUES (?, ?)',
+                (year, month)).rowcount
+        if created:
+            log.event(log.INFO, 'month_created',
+                      "Created month :: %(month)s",
+                      month=self.describe(year, month))
+
+        rows = self.execute(self.select_sql, (year, month)).fetchall()
+        store = ColumnStore(keys)
+        if rows:
+            ids = store.load_columns([list(col) for col in zip(*rows)])
+        else:
+            ids = range(0)
+        registry.count('storage.rows_loaded', len(ids))
+        return store, ids
+
+    @timed('storage.save')
+    def save(self, year, month, store, ids):
+        """
+        Replaces a month's rows with these, and clears its journal, in a
+        single transaction.
+
+        :param store: ColumnStore holding the rows
+        :param ids: IDs of the rows to save, in order
+        :raise ValueError: If a row has cells that couldn't be parsed. The
+         typed columns can't hold their text, so nothing is saved.
+        """
+        invalid = [rid for rid in ids if not store.is_valid(rid)]
+        if invalid:
+            raise ValueError(f"{len(invalid)} row(s) of "
+                             f"{self.describe(year, month)} have cells that "
+                             f"can't be read, ex {store.get_row(invalid[0])}")
+
+        columns = []
+        for name in keys:
+            if name in store.columns:
+                columns.append(store.column(name).export(ids))
+            else:
+                columns.append([self.DEFAULTS.get(name, '')] * len(ids))
+
+        rows = [(year, month, position, *row)
+                for position, row in enumerate(zip(*columns))]
+
+        with self.connect() as conn:
+            conn.execute('INSERT OR IGNORE INTO months (year, month) '
+                         'VALUES (?, ?)', (year, month))
+            conn.execute('UPDATE months SET version = version + 1 '
+                         'WHERE year = ? AND month = ?', (year, month))
+            conn.execute('DELETE FROM transactions '
+                         'WHERE year = ? AND month = ?', (year, month))
+            conn.executemany(self.insert_sql, rows)
+            conn.execute('DELETE FROM journal WHERE year = ? AND month = ?',
+                         (year, month))
+        registry.count('storage.rows_saved', len(rows))
+
+    def get_stamp(self, year, month):
+        """Returns a value that changes every time a month is saved."""
+        row = self.execute('SELECT version FROM months '
+                           'WHERE year = ? AND month = ?',
+                           (year, month)).fetchone()
+        return (row[0] if row else 0,)
+
+    def open_journal(self, year, month):
+        """Returns the SQLiteJournal that records a month's changes."""
+        return SQLiteJournal(self, year, month)
+
+    @timed('aggregate.sql')
+    def matching_months(self, filters, min_cents=None, max_cents=None):
+        """
+        Finds the months that can hold rows passing a Query's filters,
+        without loading any. Months with unsaved journal records are
+        always included, as their rows may differ from the saved ones.
+
+        :param filters: Dict of header name -> set of wanted values, or
+         None for no filter, ex {'Category': {'Food'}}
+        :param min_cents: Smallest amount wanted, or None
+        :param max_cents: Largest amount wanted, or None
+        :return: Set of (year, month) pairs
+        """
+        where = []
+        parameters = []
+        for name, values in filters.items():
+            if values is not None:
+                where.append(f'"{name}" IN '
+                             f'({", ".join("?" * len(values))})')
+                parameters.extend(sorted(values))
+        if min_cents is not None:
+            where.append('"Amount" >= ?')
+            parameters.append(min_cents)
+        if max_cents is not None:
+            where.append('"Amount" <= ?')
+            parameters.append(max_cents)
+
+        sql = 'SELECT DISTINCT year, month FROM transactions'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' UNION SELECT DISTINCT year, month FROM journal'
+        return set(self.execute(sql, parameters).fetchall())
+
+    def summarize(self, year=None):
+        """
+        Totals saved transactions in the database rather than in memory.
+
+        :param year: Only total months from this year, ex '2023'
+        :return: Summary
+        """
+        sql = ('SELECT "Transaction", "Category", "Subcategory", '
+               'SUM("Amount") FROM transactions')
+        parameters = ()
+        if year is not None:
+            sql += ' WHERE year = ?'
+            parameters = (year,)
+        sql += ' GROUP BY "Transaction", "Category", "Subcategory"'
+
+        summary = Summary()
+        for trans, cat, sub, cents in self.execute(sql, parameters):
+            summary.add(trans, cat, sub, cents)
+        return summary
@@ -0,0 +1,658 @@
+"""
+Column-oriented storage for a month of transaction data.
+
+Each CSV column is kept in its own container instead of a list of rows:
+- Day is a typed array of small integers
+- Amount is a typed array of integer cents
+- Transaction, Category, and Subcategory are stored together as a single
+  code per row, numbered by the compiled taxonomy (see taxonomy.py)
+- Anything else (Company, Note) stays as plain text
+
+Values are parsed once when a row enters the store, so consumers can work
+on the typed arrays directly instead of re-parsing strings. A cell that
+can't be parsed, ex a Day of 'xx', counts as 0 in its typed column, and
+its text is kept so the row is saved back exactly as it was read.
+"""
+
+from array import array
+from bisect import bisect_left
+from operator import itemgetter
+import log
+from taxonomy import taxonomy as default_taxonomy
+
+
+# Largest amount a MoneyColumn holds, in cents
+MAX_CENTS = 2 ** 63 - 1
+
+
+def parse_cents(text):
+    """
+    Convert a money string into an integer number of cents, exactly. The
+    digits are read as they are rather than through a float, so amounts
+    like '0.29' don't come out a cent off and totals stay exact. Past two
+    decimal places, amounts are rounded half away from zero.
+
+    :param text: Amount as str, ex '383.59', '-12.5', or '+.75'
+    :return: Amount as int, ex 38359
+    :raise ValueError: If text isn't a plain decimal amount, or is too
+     large to store
+    """
+    digits = text.strip()
+    sign = digits[:1]
+    if sign in ('-', '+'):
+        digits = digits[1:]
+
+    whole, _, part = digits.partition('.')
+    if not (whole + part).isdigit():
+        raise ValueError(f"invalid amount: {text!r}")
+
+    if len(part) == 2:
+        cents = int(whole + part)       # The usual case, ex '383.59'
+    else:
+        cents = int(whole or '0') * 100 + int(part[:2].ljust(2, '0'))
+        if part[2:3] >= '5':
+            cents += 1
+    if cents > MAX_CENTS:
+        raise ValueError(f"amount out of range: {text!r}")
+    return -cents if sign == '-' else cents
+
+
+def to_cents(text):
+    """
+    Convert a money string into an integer number of cents, reporting an
+    amount that can't be read and counting it as 0.
+
+    :param text: Amount as str, ex '383.59'
+    :return: Amount as int, ex 38359
+    """
+    try:
+        return parse_cents(text)
+    except ValueError as err:
+        if log.is_enabled(log.WARNING):
+            log.event(log.WARNING, 'bad_amount', "ValueError ::  %(error)s"
+                      "  :: Check CSV for amount errors.", error=err)
+        return 0
+
+
+def from_cents(cents):
+    """
+    Convert an integer number of cents back into a money string.
+
+    :param cents: Amount as int, ex 38359
+    :return: Amount as str, ex '383.59'
+    """
+    sign = '-' if cents < 0 else ''
+    whole, part = divmod(abs(cents), 100)
+    return f"{sign}{whole}.{part:02}"
+
+
+class TextColumn:
+    """A column of free text, such as Company or Note."""
+
+    def __init__(self):
+        self.values = []
+
+    def parse(self, text):
+        return text
+
+    def format(self, value):
+        return value
+
+    def get_text(self, i):
+        return self.format(self.values[i])
+
+    def matching(self, texts):
+        """Returns the set of values equal to any of these strings."""
+        return set(texts)
+
+    def append(self, text):
+        self.values.append(self.parse(text))
+
+    def set(self, i, text):
+        self.values[i] = self.parse(text)
+
+    def append_value(self, value):
+        """Appends a value returned by parse."""
+        self.values.append(value)
+
+    def set_value(self, i, value):
+        """Overwrites a value with one returned by parse."""
+        self.values[i] = value
+
+    def extend(self, values):
+        """Appends values that are already parsed, ex read from a database."""
+        self.values.extend(values)
+
+    def export(self, ids):
+        """Returns the parsed values for these row IDs, as a list."""
+        values = self.values
+        return [values[i] for i in ids]
+
+    def dump(self, ids):
+        """Returns the values for these row IDs, in a form marshal saves."""
+        return [self.values[i] for i in ids]
+
+    def restore(self, data):
+        """
+        Replaces the column's values with ones returned by dump. Done in
+        place, since indexes hold on to self.values.
+        """
+        self.values[:] = data
+
+
+class ArrayColumn(TextColumn):
+    """A column of numbers, stored in a typed array."""
+
+    typecode = 'q'
+
+    def __init__(self):
+        self.values = array(self.typecode)
+
+    def dump(self, ids):
+        values = self.values
+        return array(self.typecode, [values[i] for i in ids]).tobytes()
+
+    def restore(self, data):
+        del self.values[:]
+        self.values.frombytes(data)
+
+
+class DayColumn(ArrayColumn):
+    """A column of days of the month, stored as unsigned bytes."""
+
+    typecode = 'B'
+
+    def parse(self, text):
+        try:
+            day = int(text)
+        except ValueError:
+            raise ValueError(f"invalid day: {text!r}") from None
+        if not 0 <= day <= 255:
+            raise ValueError(f"day out of range: {text!r}")
+        return day
+
+    def format(self, value):
+        return str(value)
+
+
+class MoneyColumn(ArrayColumn):
+    """A column of amounts, stored as signed 64-bit integer cents."""
+
+    typecode = 'q'
+
+    def parse(self, text):
+        return parse_cents(text)
+
+    def format(self, value):
+        return from_cents(value)
+
+
+class CodeColumn(ArrayColumn):
+    """
+    A column of often-repeated strings, stored as integer codes.
+
+    Each distinct string is kept once in self.strings, and self.values only
+    holds its position in that list.
+    """
+
+    typecode = 'H'
+
+    def __init__(self):
+        super().__init__()
+        self.strings = []           # Code -> string
+        self.codes = {}             # String -> code
+
+    def parse(self, text):
+        try:
+            return self.codes[text]
+        except KeyError:
+            code = len(self.strings)
+            self.strings.append(text)
+            self.codes[text] = code
+            return code
+
+    def format(self, value):
+        return self.strings[value]
+
+    def matching(self, texts):
+        """Returns the set of codes for any of these strings."""
+        return {self.codes[text] for text in texts if text in self.codes}
+
+    def extend(self, values):
+        self.values.extend(map(self.parse, values))
+
+    def export(self, ids):
+        strings, values = self.strings, self.values
+        return [strings[values[i]] for i in ids]
+
+    def dump(self, ids):
+        return super().dump(ids), self.strings
+
+    def restore(self, data):
+        codes, self.strings = data
+        super().restore(codes)
+        self.codes = {text: code for code, text in enumerate(self.strings)}
+
+
+class KeyColumn(CodeColumn):
+    """
+    The Transaction, Category, and Subcategory of every row, stored as one
+    code per row for the (trans, cat, sub) triple.
+
+    Codes below len(taxonomy) are the taxonomy's own leaf IDs, so totals
+    indexed by code roll straight up through it. Triples that aren't in
+    the taxonomy get the codes after those, in this column only.
+    """
+
+    NAMES = ('Transaction', 'Category', 'Subcategory')
+
+    def __init__(self, taxonomy=default_taxonomy):
+        """
+        :param taxonomy: Compiled Taxonomy that numbers the known triples
+        """
+        super().__init__()
+        self.taxonomy = taxonomy
+        self.strings = list(taxonomy.leaves)    # Code -> triple
+        self.codes = dict(taxonomy.ids)         # Triple -> code
+
+    def restore(self, data):
+        """
+        Replaces the codes with ones returned by dump. If the taxonomy has
+        changed since, they are renumbered to match it.
+        """
+        codes, triples = data
+        ArrayColumn.restore(self, codes)
+        new = [self.parse(tuple(triple)) for triple in triples]
+        if new != list(range(len(triples))):
+            self.values[:] = array(self.typecode,
+                                   [new[code] for code in self.values])
+
+
+class KeyPart:
+    """
+    The Transaction, Category, or Subcategory column, read from the row's
+    KeyColumn code. ColumnStore writes all three through the KeyColumn at
+    once, so writes here do nothing.
+    """
+
+    def __init__(self, key, level):
+        """
+        :param key: KeyColumn holding the codes
+        :param level: 0 for Transaction, 1 for Category, 2 for Subcategory
+        """
+        self.key = key
+        self.level = level
+
+    @property
+    def values(self):
+        """Codes indexed by row ID, shared with the other two parts."""
+        return self.key.values
+
+    def format(self, code):
+        return self.key.strings[code][self.level]
+
+    def get_text(self, i):
+        return self.key.strings[self.key.values[i]][self.level]
+
+    def matching(self, texts):
+        """Returns the set of codes whose part is any of these strings."""
+        level = self.level
+        return {code for code, triple in enumerate(self.key.strings)
+                if triple[level] in texts}
+
+    def export(self, ids):
+        triples, values, level = self.key.strings, self.key.values, self.level
+        return [triples[values[i]][level] for i in ids]
+
+    def parse(self, text):
+        return None
+
+    def append(self, text):
+        pass
+
+    def set(self, i, text):
+        pass
+
+    def append_value(self, value):
+        pass
+
+    def set_value(self, i, value):
+        pass
+
+    def extend(self, values):
+        pass
+
+    def dump(self, ids):
+        return None
+
+    def restore(self, data):
+        pass
+
+
+# Storage type for each known header. Unknown headers are stored as text.
+# Transaction, Category, and Subcategory are only stored separately if the
+# header doesn't have all three.
+COLUMN_TYPES = {
+    'Day': DayColumn,
+    'Transaction': CodeColumn,
+    'Category': CodeColumn,
+    'Subcategory': CodeColumn,
+    'Amount': MoneyColumn,
+}
+
+
+class ColumnStore:
+    """
+    A table of transactions stored column by column.
+
+    Rows are only ever appended, so a row's slot never moves. The slot is
+    used as the row's ID: looking up, editing, or deleting a row by ID is
+    direct indexing. Deleted rows are marked dead rather than removed, and
+    disappear the next time the file is loaded.
+
+    Rows with cells that can't be parsed are invalid. The cells are 0 in
+    their typed columns and their text is kept in self.raw, which
+    get_row and get_value return instead.
+    """
+
+    def __init__(self, header):
+        """
+        Builds one column per header entry.
+
+        :param header: CSV header row, ex ['Day', 'Company', ...]
+        """
+        self.header = list(header)
+
+        # Header name -> column index, resolved once
+        self.columns = {name: i for i, name in enumerate(self.header)}
+
+        # Transaction, Category, and Subcategory as one code per row
+        self.key = None
+        if all(name in self.columns for name in KeyColumn.NAMES):
+            self.key = KeyColumn()
+            self.key_index = [self.columns[name] for name in KeyColumn.NAMES]
+            self.get_key = itemgetter(*self.key_index)
+
+        # Column containers, in header order
+        self.cols = [self._make_column(name) for name in self.header]
+
+        self.alive = bytearray()    # 1 if the row in that slot is live
+        self.length = 0             # Number of live rows
+
+        # Row ID -> {column index: text} for cells that couldn't be parsed
+        self.raw = {}
+
+    def __len__(self):
+        return self.length
+
+    def __contains__(self, rid):
+        return 0 <= rid < len(self.alive) and self.alive[rid] == 1
+
+    def _make_column(self, name):
+        """Returns an empty column container for a header name."""
+        if self.key is not None and name in KeyColumn.NAMES:
+            return KeyPart(self.key, KeyColumn.NAMES.index(name))
+        return COLUMN_TYPES.get(name, TextColumn)()
+
+    def column(self, name):
+        """Returns the column container for a header name."""
+        return self.cols[self.columns[name]]
+
+    def _fit(self, row):
+        """Pads or trims a row so it has one cell per column."""
+        width = len(self.cols)
+        if len(row) < width:
+            return list(row) + [''] * (width - len(row))
+        return row[:width]
+
+    def load(self, rows):
+        """
+        Appends many rows at once, ex the contents of a CSV file.
+
+        :return: IDs of the new rows, in the order given
+        """
+        return [self.append_row(row) for row in rows]
+
+    def load_columns(self, columns):
+        """
+        Appends many rows given column by column, with values already in
+        each column's type, ex Day as int and Amount as cents.
+
+        :param columns: One list of values per header entry
+        :return: IDs of the new rows, in the order given
+        """
+        start = len(self.alive)
+        count = len(columns[0]) if columns else 0
+        for col, values in zip(self.cols, columns):
+            col.extend(values)
+        if self.key is not None:
+            self.key.extend(zip(*[columns[i] for i in self.key_index]))
+        self.alive.extend(b'\x01' * count)
+        self.length += count
+        return range(start, start + count)
+
+    def export(self, ids):
+        """
+        Returns the rows with these IDs column by column, in the form
+        load_columns takes.
+        """
+        return [col.export(ids) for col in self.cols]
+
+    def to_cache(self, ids):
+        """
+        Returns the columns for these row IDs, in the given order, as plain
+        data that FileCSV.write_cache can save.
+        """
+        return {
+            'header': self.header,
+            'length': len(ids),
+            'columns': [col.dump(ids) for col in self.cols],
+            'key': self.key.dump(ids) if self.key is not None else None,
+            'raw': {position: self.raw[rid]
+                    for position, rid in enumerate(ids) if rid in self.raw}
+            if self.raw else {},
+        }
+
+    def from_cache(self, payload):
+        """
+        Fills an empty store from data returned by to_cache.
+
+        :return: IDs of the loaded rows, in the saved order
+        """
+        for col, data in zip(self.cols, payload['columns']):
+            col.restore(data)
+        if self.key is not None:
+            self.key.restore(payload['key'])
+        self.length = payload['length']
+        self.alive = bytearray(b'\x01' * self.length)
+        self.raw = dict(payload['raw'])
+        return range(self.length)
+
+    def ids(self):
+        """Returns the IDs of all live rows, in slot order."""
+        return [rid for rid, live in enumerate(self.alive) if live]
+
+    def get_row(self, rid):
+        """Returns the row with this ID as a list of strings."""
+        row = [col.get_text(rid) for col in self.cols]
+        raw = self.raw.get(rid)
+        if raw:
+            for c, text in raw.items():
+                row[c] = text
+        return row
+
+    def get_value(self, rid, c):
+        """Returns the string at column c of the row with this ID."""
+        raw = self.raw.get(rid)
+        if raw and c in raw:
+            return raw[c]
+        return self.cols[c].get_text(rid)
+
+    def is_valid(self, rid):
+        """Returns False if any cell of the row couldn't be parsed."""
+        return rid not in self.raw
+
+    def _parse(self, row):
+        """
+        Parses a row of strings, one value per column. Nothing is stored
+        until every cell has been parsed, so a bad cell can't leave the
+        columns out of step.
+
+        :return: The values, and a dict of column index -> text for the
+         cells that couldn't be parsed, or None
+        """
+        values = []
+        raw = None
+        for c, (col, text) in enumerate(zip(self.cols, row)):
+            try:
+                values.append(col.parse(text))
+            except ValueError as err:
+                if log.is_enabled(log.WARNING):
+                    log.event(log.WARNING, 'bad_cell',
+                              "ValueError ::  %(error)s  :: Check CSV for "
+                              "%(column)s errors.", error=err,
+                              column=self.header[c])
+                values.append(0)
+                if raw is None:
+                    raw = {}
+                raw[c] = text
+        return values, raw
+
+    def append_row(self, row):
+        """
+        Adds a row of strings in a new slot.
+
+        :return: ID of the new row
+        """
+        row = self._fit(row)
+        values, raw = self._parse(row)
+        if self.key is not None:
+            self.key.append_value(self.key.parse(self.get_key(row)))
+        for col, value in zip(self.cols, values):
+            col.append_value(value)
+        self.alive.append(1)
+        self.length += 1
+        rid = len(self.alive) - 1
+        if raw:
+            self.raw[rid] = raw
+        return rid
+
+    def set_row(self, rid, row):
+        """Overwrites the row with this ID with a row of strings."""
+        row = self._fit(row)
+        values, raw = self._parse(row)
+        if self.key is not None:
+            self.key.set_value(rid, self.key.parse(self.get_key(row)))
+        for col, value in zip(self.cols, values):
+            col.set_value(rid, value)
+        if raw:
+            self.raw[rid] = raw
+        else:
+            self.raw.pop(rid, None)
+
+    def delete_row(self, rid):
+        """Marks the row with this ID as deleted and returns its strings."""
+        if rid not in self:
+            raise IndexError(f"row ID {rid} does not exist")
+        self.alive[rid] = 0
+        self.length -= 1
+        return self.get_row(rid)
+
+
+class DayIndex:
+    """
+    Row IDs kept sorted by day, used for display order and day ranges.
+
+    Each row gets a sort key of (day, sequence number), packed into one
+    integer. The sequence number is handed out whenever a row is placed,
+    so rows on the same day stay in the order they were added. Keys are
+    unique, which lets a row's position be found by binary search.
+    """
+
+    SEQ_BITS = 32
+
+    def __init__(self, days):
+        """
+        :param days: Typed Day column, indexed by row ID
+        """
+        self.days = days
+        self.keys = array('Q')      # Sort key, indexed by row ID
+        self.order = []             # Row IDs, sorted by key
+        self.counter = 0            # Next sequence number
+
+    def __len__(self):
+        return len(self.order)
+
+    def _set_key(self, rid):
+        """Gives a row a fresh key based on its current day."""
+        if rid >= len(self.keys):
+            self.keys.extend([0] * (rid + 1 - len(self.keys)))
+        self.keys[rid] = (self.days[rid] << self.SEQ_BITS) | self.counter
+        self.counter += 1
+
+    def _bisect(self, key):
+        return bisect_left(self.order, key, key=self.keys.__getitem__)
+
+    def build(self, ids):
+        """Indexes many rows at once, keeping their given order per day."""
+        for rid in ids:
+            self._set_key(rid)
+        self.order[:] = sorted(ids, key=self.keys.__getitem__)
+
+    def add(self, rid):
+        """
+        Places a row after any rows on the same day or earlier.
+
+        :return: The row's position in the order
+        """
+        self._set_key(rid)
+        index = self._bisect(self.keys[rid])
+        self.order.insert(index, rid)
+        return index
+
+    def extend(self, ids):
+        """
+        Places many rows at once, each after any rows on the same day or
+        earlier, keeping their given order per day. The new rows are
+        sorted, then merged into the order in a single pass.
+
+        :return: The new rows' IDs and positions, both in display order
+        """
+        for rid in ids:
+            self._set_key(rid)
+        new = sorted(ids, key=self.keys.__getitem__)
+
+        # Both runs are already sorted, so this sort is a linear merge
+        self.order[:] = sorted(self.order + new, key=self.keys.__getitem__)
+
+        added = set(new)
+        positions = [i for i, rid in enumerate(self.order) if rid in added]
+        return new, positions
+
+    def position(self, rid):
+        """Returns a row's position in the order."""
+        index = self._bisect(self.keys[rid])
+        if index == len(self.order) or self.order[index] != rid:
+            raise ValueError(f"row ID {rid} is not in the day index")
+        return index
+
+    def remove(self, rid):
+        """
+        Takes a row out of the order.
+
+        :return: The position the row had
+        """
+        index = self.position(rid)
+        del self.order[index]
+        return index
+
+    def day_range(self, first, last):
+        """
+        Returns the IDs of rows from day first to day last, inclusive.
+
+        :param first: First day of the range, ex 10
+        :param last: Last day of the range, ex 20
+        """
+        lo = self._bisect(first << self.SEQ_BITS)
+        hi = self._bisect((last + 1) << self.SEQ_BITS)
+        return self.order[lo:hi]
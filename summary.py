@@ -0,0 +1,140 @@
+"""
+Group-by aggregation of transaction amounts.
+
+Each row's (Transaction, Category, Subcategory) is a single KeyColumn
+code, numbered by the compiled taxonomy. Amounts are summed into a list
+indexed by that code in a single pass over the typed columns, then rolled
+up into Category and Transaction totals through the taxonomy's parent
+tables. Only keys that aren't in the taxonomy are handled as strings. All
+totals are kept in integer cents.
+"""
+
+from itertools import compress
+from categories import categories
+from metrics import timed
+from taxonomy import Taxonomy
+from taxonomy import taxonomy as default_taxonomy
+
+
+@timed('aggregate.key_totals')
+def key_totals(store):
+    """
+    Sums the Amount column of a ColumnStore per KeyColumn code.
+
+    :param store: ColumnStore with a key column
+    :return: List of cents indexed by code
+    """
+    amounts = store.column('Amount').values
+    totals = [0] * len(store.key.strings)
+    for code, cents in compress(zip(store.key.values, amounts),
+                                store.alive):
+        totals[code] += cents
+    return totals
+
+
+@timed('aggregate.group_totals')
+def group_totals(store):
+    """
+    Sums the Amount column of a ColumnStore per subcategory.
+
+    :param store: ColumnStore with a key column
+    :return: Dict of (transaction, category, subcategory) -> cents, for
+     every triple found in the store's rows
+    """
+    totals = key_totals(store)
+    used = set(compress(store.key.values, store.alive))
+    return {store.key.strings[code]: totals[code] for code in used}
+
+
+class Summary:
+    """Transaction, Category, and Subcategory totals, in cents."""
+
+    def __init__(self, taxonomy=categories):
+        """
+        Starts every total in the taxonomy at zero.
+
+        :param taxonomy: Nested dict of transaction types, categories, and
+         subcategories, ex categories.categories
+        """
+        self.taxonomy = taxonomy
+        self.compiled = default_taxonomy if taxonomy is categories \
+            else Taxonomy(taxonomy)
+
+        self.transactions = {}      # trans -> cents
+        self.categories = {}        # (trans, cat) -> cents
+        self.subcategories = {}     # (trans, cat, sub) -> cents
+        for trans, cats in taxonomy.items():
+            self.transactions[trans] = 0
+            for cat, subs in cats.items():
+                self.categories[(trans, cat)] = 0
+                for sub in subs:
+                    self.subcategories[(trans, cat, sub)] = 0
+
+        # Totals for rows whose keys aren't in the taxonomy
+        self.unknown = {}           # (trans, cat, sub) -> cents
+
+    def add(self, trans, cat, sub, cents):
+        """Adds an amount to a subcategory and every level above it."""
+        key = (trans, cat, sub)
+        if key in self.subcategories:
+            self.subcategories[key] += cents
+            self.categories[(trans, cat)] += cents
+            self.transactions[trans] += cents
+        else:
+            self.unknown[key] = self.unknown.get(key, 0) + cents
+
+    def __eq__(self, other):
+        """
+        Totals are equal if every transaction, category, subcategory, and
+        unknown key matches. The roll-ups are compared too, so drift in a
+        running category or transaction total is caught.
+        """
+        if not isinstance(other, Summary):
+            return NotImplemented
+
+        # An unknown key can be left at zero after its rows are removed
+        def nonzero(totals):
+            return {k: v for k, v in totals.items() if v}
+
+        return (self.subcategories == other.subcategories
+                and self.categories == other.categories
+                and self.transactions == other.transactions
+                and nonzero(self.unknown) == nonzero(other.unknown))
+
+    def add_store(self, store):
+        """Adds every transaction in a ColumnStore."""
+        compiled = self.compiled
+        if store.key is None or store.key.taxonomy is not compiled:
+            for key, cents in group_totals(store).items():
+                self.add(*key, cents)
+            return self
+
+        # Codes are leaf IDs, so rolling up is indexing
+        totals = key_totals(store)
+        category_totals, type_totals = compiled.rollup(totals)
+        for leaf, key in enumerate(compiled.leaves):
+            self.subcategories[key] += totals[leaf]
+        for category, key in enumerate(compiled.categories):
+            self.categories[key] += category_totals[category]
+        for type_id, trans in enumerate(compiled.types):
+            self.transactions[trans] += type_totals[type_id]
+
+        # Codes past the taxonomy are keys it doesn't have
+        if len(totals) > len(compiled):
+            used = set(compress(store.key.values, store.alive))
+            for code in range(len(compiled), len(totals)):
+                if code in used:
+                    key = store.key.strings[code]
+                    self.unknown[key] = self.unknown.get(key, 0) \
+                        + totals[code]
+        return self
+
+    def as_dict(self):
+        """
+        Returns the subcategory totals in dollars, nested in the same
+        shape as the taxonomy.
+        """
+        return {trans: {cat: {sub: self.subcategories[(trans, cat, sub)] / 100
+                              for sub in subs}
+                        for cat, subs in cats.items()}
+                for trans, cats in self.taxonomy.items()}
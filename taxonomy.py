@@ -0,0 +1,80 @@
+"""
+The category taxonomy compiled into flat tables of integer IDs.
+
+categories.categories nests subcategories under categories under
+transaction types. Walking it for every row means three dict lookups on
+long strings. Compiled once, every (transaction, category, subcategory)
+triple becomes a small leaf ID, and a leaf's parents are found by
+indexing:
+
+    category = taxonomy.category_of[leaf]
+    trans = taxonomy.type_of[category]
+
+Rows store a single leaf ID (see store.KeyColumn), so totalling is adding
+amounts into a list indexed by leaf ID, then rolling that list up.
+"""
+
+from array import array
+from categories import categories
+
+
+class Taxonomy:
+    """A nested taxonomy, numbered in the order it's written."""
+
+    def __init__(self, tree=categories):
+        """
+        :param tree: Nested dict of transaction types, categories, and
+         subcategories, ex categories.categories
+        """
+        self.tree = tree
+
+        self.types = []             # Type ID -> transaction type
+        self.categories = []        # Category ID -> (trans, cat)
+        self.leaves = []            # Leaf ID -> (trans, cat, sub)
+        self.type_of = array('H')       # Category ID -> type ID
+        self.category_of = array('H')   # Leaf ID -> category ID
+
+        for trans, cats in tree.items():
+            type_id = len(self.types)
+            self.types.append(trans)
+            for cat, subs in cats.items():
+                category_id = len(self.categories)
+                self.categories.append((trans, cat))
+                self.type_of.append(type_id)
+                for sub in subs:
+                    self.leaves.append((trans, cat, sub))
+                    self.category_of.append(category_id)
+
+        # (trans, cat, sub) -> leaf ID
+        self.ids = {leaf: i for i, leaf in enumerate(self.leaves)}
+
+    def __len__(self):
+        """Returns the number of leaves."""
+        return len(self.leaves)
+
+    def leaf_id(self, trans, cat, sub):
+        """Returns a triple's leaf ID, or None if it isn't in the taxonomy."""
+        return self.ids.get((trans, cat, sub))
+
+    def rollup(self, totals):
+        """
+        Adds per-leaf totals up to their categories and types.
+
+        :param totals: List indexed by leaf ID, ex cents per leaf. Entries
+         past the last leaf, ex for rows with unknown keys, are ignored.
+        :return: Category totals and type totals, as lists indexed by ID
+        """
+        category_totals = [0] * len(self.categories)
+        category_of = self.category_of
+        for leaf in range(len(self.leaves)):
+            category_totals[category_of[leaf]] += totals[leaf]
+
+        type_totals = [0] * len(self.types)
+        type_of = self.type_of
+        for category, total in enumerate(category_totals):
+            type_totals[type_of[category]] += total
+        return category_totals, type_totals
+
+
+# Compiled once, from categories.categories
+taxonomy = Taxonomy()
@@ -0,0 +1,154 @@
+"""Tests for MonthlyFinances: journal crash recovery and running totals."""
+
+import os
+import tempfile
+import unittest
+
+from reader import MonthlyFinances
+
+
+ROWS = [
+    ['12', 'Landlord', 'Expense', 'Housing', 'Rent', '950.00', ''],
+    ['3', 'Employer', 'Income', 'Employment', 'Salary', '2100.50', ''],
+    ['3', 'ISP', 'Expense', 'Utilities', 'Internet', '45.10', 'June'],
+]
+
+
+class ReaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = self.tmp.name
+        self.opened = []
+
+    def tearDown(self):
+        for content in self.opened:
+            content.writer.close()
+        self.tmp.cleanup()
+
+    def open_month(self):
+        content = MonthlyFinances('2023', '06', directory=self.directory)
+        self.opened.append(content)
+        return content
+
+    def rows(self, content):
+        return [content.get_entry(rid) for rid in content.order]
+
+    def journal_path(self):
+        return os.path.join(self.directory, '2023-06-journal.csv')
+
+
+class TestJournalRecovery(ReaderTestCase):
+    def crash(self, content):
+        """Writes out the journal and stops, without saving the month."""
+        content.flush()
+        content.writer.close()
+
+    def test_recovers_adds(self):
+        content = self.open_month()
+        for row in ROWS:
+            content.add_row(row)
+        expected = self.rows(content)
+        self.crash(content)
+
+        recovered = self.open_month()
+        self.assertEqual(self.rows(recovered), expected)
+        self.assertEqual(recovered.totals, content.totals)
+
+    def test_recovers_replace_and_delete(self):
+        content = self.open_month()
+        ids = [content.add_row(row) for row in ROWS]
+        content.commit_changes()
+
+        content.replace_row(ids[0], ['1', 'Landlord', 'Expense', 'Housing',
+                                     'Rent', '975.00', 'Raised'])
+        content.del_row(ids[2])
+        expected = self.rows(content)
+        self.crash(content)
+
+        recovered = self.open_month()
+        self.assertEqual(self.rows(recovered), expected)
+        self.assertTrue(recovered.check_totals())
+
+    def test_saved_month_leaves_no_journal(self):
+        content = self.open_month()
+        content.add_row(ROWS[0])
+        content.close_month(save=True)
+        self.assertFalse(os.path.exists(self.journal_path()))
+
+        reopened = self.open_month()
+        self.assertEqual(self.rows(reopened), [ROWS[0]])
+
+    def test_discards_stale_journal(self):
+        # A crash between saving and deleting the journal
+        content = self.open_month()
+        content.add_row(ROWS[0])
+        content.flush()
+        with open(self.journal_path(), 'rb') as file:
+            journal = file.read()
+        content.close_month(save=True)
+        with open(self.journal_path(), 'wb') as file:
+            file.write(journal)
+
+        reopened = self.open_month()
+        self.assertEqual(self.rows(reopened), [ROWS[0]])
+        self.assertFalse(os.path.exists(self.journal_path()))
+
+    def test_stops_at_partial_record(self):
+        content = self.open_month()
+        content.add_row(ROWS[0])
+        content.add_row(ROWS[1])
+        expected = self.rows(content)
+        self.crash(content)
+        with open(self.journal_path(), 'a', encoding='utf-8') as file:
+            file.write('=,99\n')
+
+        recovered = self.open_month()
+        self.assertEqual(self.rows(recovered), expected)
+
+    def test_sets_aside_unreadable_journal(self):
+        content = self.open_month()
+        content.add_row(ROWS[0])
+        content.close_month(save=True)
+        with open(self.journal_path(), 'wb') as file:
+            file.write(b'+,0,\xff\xfe\n')
+
+        reopened = self.open_month()
+        self.assertEqual(self.rows(reopened), [ROWS[0]])
+        self.assertFalse(os.path.exists(self.journal_path()))
+        set_aside = [name for name in os.listdir(self.directory)
+                     if name.endswith('.bad')]
+        self.assertEqual(len(set_aside), 1)
+
+
+class TestCheckTotals(ReaderTestCase):
+    def test_after_add(self):
+        content = self.open_month()
+        for row in ROWS:
+            content.add_row(row)
+            self.assertTrue(content.check_totals())
+
+    def test_after_replace(self):
+        content = self.open_month()
+        ids = [content.add_row(row) for row in ROWS]
+        # Moves the amount to another category and transaction type
+        content.replace_row(ids[2], ['3', 'Employer', 'Income', 'Gifts',
+                                     'Reward', '-0.29', ''])
+        self.assertTrue(content.check_totals())
+
+    def test_after_delete(self):
+        content = self.open_month()
+        ids = [content.add_row(row) for row in ROWS]
+        for rid in ids:
+            content.del_row(rid)
+            self.assertTrue(content.check_totals())
+        self.assertEqual(content.order, [])
+
+    def test_detects_drift(self):
+        content = self.open_month()
+        content.add_row(ROWS[0])
+        content.totals = content.totals.__class__()
+        self.assertFalse(content.check_totals())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+"""Tests for store.py: parse_cents, the day index, and unreadable cells."""
+
+from array import array
+import unittest
+
+from store import ColumnStore
+from store import DayIndex
+from store import MAX_CENTS
+from store import from_cents
+from store import parse_cents
+
+
+HEADER = ['Day', 'Company', 'Transaction', 'Category', 'Subcategory',
+          'Amount', 'Note']
+
+
+class TestParseCents(unittest.TestCase):
+    def test_plain_amounts(self):
+        self.assertEqual(parse_cents('383.59'), 38359)
+        self.assertEqual(parse_cents('0.29'), 29)
+        self.assertEqual(parse_cents('10'), 1000)
+        self.assertEqual(parse_cents('0'), 0)
+
+    def test_signs_and_short_parts(self):
+        self.assertEqual(parse_cents('-12.5'), -1250)
+        self.assertEqual(parse_cents('+.75'), 75)
+        self.assertEqual(parse_cents('-.5'), -50)
+        self.assertEqual(parse_cents('7.'), 700)
+        self.assertEqual(parse_cents(' 5.00 '), 500)
+
+    def test_rounds_half_away_from_zero(self):
+        self.assertEqual(parse_cents('1.005'), 101)
+        self.assertEqual(parse_cents('-1.005'), -101)
+        self.assertEqual(parse_cents('1.004'), 100)
+        self.assertEqual(parse_cents('-1.004'), -100)
+        self.assertEqual(parse_cents('0.999'), 100)
+
+    def test_invalid(self):
+        for text in ('', ' ', '.', '-', 'abc', '$45.10', '1,200.00',
+                     '1e3', '1.2.3', '--5', '- 5', 'nan'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    parse_cents(text)
+
+    def test_range(self):
+        largest = from_cents(MAX_CENTS)
+        self.assertEqual(parse_cents(largest), MAX_CENTS)
+        self.assertEqual(parse_cents('-' + largest), -MAX_CENTS)
+        with self.assertRaises(ValueError):
+            parse_cents(from_cents(MAX_CENTS + 1))
+
+    def test_round_trip(self):
+        for text in ('383.59', '-0.01', '0.00', '-12.50'):
+            self.assertEqual(from_cents(parse_cents(text)), text)
+
+
+class TestDayIndex(unittest.TestCase):
+    def make_index(self, days):
+        index = DayIndex(array('B', days))
+        index.build(range(len(days)))
+        return index
+
+    def test_build_sorts_by_day_and_keeps_order(self):
+        index = self.make_index([5, 1, 5, 3, 1])
+        self.assertEqual(index.order, [1, 4, 3, 0, 2])
+
+    def test_add_goes_after_same_day(self):
+        days = array('B', [5, 1, 3])
+        index = DayIndex(days)
+        index.build(range(3))
+        days.append(3)
+        self.assertEqual(index.add(3), 2)
+        self.assertEqual(index.order, [1, 2, 3, 0])
+
+    def test_extend_merges(self):
+        days = array('B', [2, 8])
+        index = DayIndex(days)
+        index.build(range(2))
+        days.extend([8, 1, 2])
+        ids, positions = index.extend([2, 3, 4])
+        self.assertEqual(index.order, [3, 0, 4, 1, 2])
+        self.assertEqual(ids, [3, 4, 2])
+        self.assertEqual(positions, [0, 2, 4])
+
+    def test_position_remove_and_range(self):
+        index = self.make_index([5, 1, 5, 3, 1])
+        self.assertEqual(index.position(3), 2)
+        self.assertEqual(index.day_range(1, 3), [1, 4, 3])
+        self.assertEqual(index.remove(4), 1)
+        self.assertEqual(index.day_range(1, 3), [1, 3])
+        with self.assertRaises(ValueError):
+            index.position(4)
+
+
+class TestUnreadableCells(unittest.TestCase):
+    def test_keeps_text(self):
+        store = ColumnStore(HEADER)
+        row = ['3x', 'Cafe', 'Expense', 'Food', 'Groceries', '$4.50', '']
+        rid = store.append_row(row)
+        self.assertFalse(store.is_valid(rid))
+        self.assertEqual(store.get_row(rid), row)
+        self.assertEqual(store.get_value(rid, 5), '$4.50')
+
+    def test_fixed_row_is_valid(self):
+        store = ColumnStore(HEADER)
+        rid = store.append_row(['3', 'Cafe', 'Expense', 'Food',
+                                'Groceries', '$4.50', ''])
+        store.set_row(rid, ['3', 'Cafe', 'Expense', 'Food', 'Groceries',
+                            '4.50', ''])
+        self.assertTrue(store.is_valid(rid))
+        self.assertEqual(store.get_value(rid, 5), '4.50')
+
+    def test_cache_round_trip(self):
+        store = ColumnStore(HEADER)
+        rows = [['1', 'Cafe', 'Expense', 'Food', 'Groceries', '4.50', ''],
+                ['32nd', 'Shop', 'Expense', 'Food', 'Groceries', '1.00', '']]
+        ids = store.load(rows)
+
+        loaded = ColumnStore(HEADER)
+        loaded_ids = loaded.from_cache(store.to_cache(ids))
+        self.assertEqual([loaded.get_row(rid) for rid in loaded_ids], rows)
+        self.assertEqual([loaded.is_valid(rid) for rid in loaded_ids],
+                         [True, False])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+"""
+Virtual scrolling for a ttk.Treeview.
+
+Instead of inserting every row up front, only the rows around the visible
+window are materialized as Treeview items. The scrollbar is driven by the
+model's row count, and rows are fetched on demand as it moves, so memory
+and time to first paint don't depend on how many rows there are.
+"""
+
+
+class VirtualTree:
+    """Shows a window of a large list of rows in a Treeview."""
+
+    def __init__(self, tree, scrollbar, buffer=20):
+        """
+        :param tree: ttk.Treeview to show rows in
+        :param scrollbar: ttk.Scrollbar attached to the tree
+        :param buffer: Extra rows to materialize above and below the window
+        """
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.buffer = buffer
+
+        self.active = False         # True while attached to a model
+        self.count = None           # Function returning the row count
+        self.fetch = None           # Function returning rows in a range
+
+        self.first = 0              # Position of the top visible row
+        self.start = 0              # Position of the first materialized row
+        self.stop = 0               # Position after the last materialized row
+
+    def attach(self, count, fetch):
+        """
+        Takes over the tree and scrollbar to show a model's rows.
+
+        :param count: Function returning the number of rows
+        :param fetch: Function taking (start, stop) and returning a list of
+         (iid, values) for the rows in that range
+        """
+        self.count, self.fetch = count, fetch
+        self.first = 0
+
+        if not self.active:
+            self.active = True
+            self.scrollbar.configure(command=self.on_scroll)
+            self.tree.configure(yscrollcommand='')
+            for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+                self.tree.bind(sequence, self.on_wheel)
+            self.tree.bind('<Up>', lambda event: self.on_key(-1))
+            self.tree.bind('<Down>', lambda event: self.on_key(1))
+
+        self.render()
+
+    def detach(self):
+        """Gives the tree and scrollbar back their normal scrolling."""
+        if not self.active:
+            return
+
+        self.active = False
+        self.count = self.fetch = None
+        self.scrollbar.configure(command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.scrollbar.set)
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>',
+                         '<Up>', '<Down>'):
+            self.tree.unbind(sequence)
+
+    def get_visible(self):
+        """Returns roughly how many rows fit in the tree at once."""
+        height = self.tree.winfo_height()
+        if height <= 1:             # Not drawn yet
+            height = int(self.tree.place_info().get('height', 560))
+        return max(1, (height - 25) // 20)
+
+    def render(self):
+        """Re-materializes the rows around the top visible row."""
+        total = self.count()
+        visible = self.get_visible()
+        self.first = max(0, min(self.first, total - visible))
+
+        # Remember the focused row so it survives the redraw
+        focus = self.tree.focus()
+
+        self.start = max(0, self.first - self.buffer)
+        self.stop = min(total, self.first + visible + self.buffer)
+
+        self.tree.delete(*self.tree.get_children())
+        for iid, values in self.fetch(self.start, self.stop):
+            self.tree.insert(parent='', index='end', iid=iid, text='',
+                             values=values)
+
+        if focus and self.tree.exists(focus):
+            self.tree.focus(focus)
+            self.tree.selection_set(focus)
+
+        self.show_first()
+
+    def refresh(self):
+        """Redraws the current window, ex after the model changed."""
+        if self.active:
+            self.render()
+
+    def show_first(self):
+        """Scrolls the tree so the top visible row is at the top."""
+        self.tree.yview_moveto(0)
+        self.tree.yview_scroll(self.first - self.start, 'units')
+
+        total = self.count()
+        if total:
+            visible = self.get_visible()
+            self.scrollbar.set(self.first / total,
+                               min(1.0, (self.first + visible) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def scroll_to(self, first):
+        """Moves the window so row position first is at the top."""
+        self.first = max(0, min(first, self.count() - self.get_visible()))
+
+        # Only fetch rows when the window leaves the materialized ones
+        if self.start <= self.first and \
+                self.first + self.get_visible() <= self.stop:
+            self.show_first()
+        else:
+            self.render()
+
+    def on_scroll(self, *args):
+        """Scrollbar command: ('moveto', fraction) or ('scroll', n, what)."""
+        if args[0] == 'moveto':
+            self.scroll_to(int(float(args[1]) * self.count()))
+        elif args[0] == 'scroll':
+            step = self.get_visible() if args[2] == 'pages' else 1
+            self.scroll_to(self.first + int(args[1]) * step)
+
+    def on_wheel(self, event):
+        """Scrolls three rows per mouse wheel notch."""
+        if event.num == 4 or event.delta > 0:
+            self.scroll_to(self.first - 3)
+        else:
+            self.scroll_to(self.first + 3)
+        return 'break'
+
+    def on_key(self, step):
+        """Moves the selection up or down a row, scrolling if needed."""
+        children = self.tree.get_children()
+        focus = self.tree.focus()
+        if not children:
+            return 'break'
+
+        # Position of the focused row in the whole list of rows
+        if focus in children:
+            position = self.start + children.index(focus) + step
+        else:
+            position = self.first
+        position = max(0, min(position, self.count() - 1))
+
+        # Keep the new row within the visible window
+        visible = self.get_visible()
+        if position < self.first:
+            self.scroll_to(position)
+        elif position >= self.first + visible:
+            self.scroll_to(position - visible + 1)
+
+        iid = self.tree.get_children()[position - self.start]
+        self.tree.focus(iid)
+        self.tree.selection_set(iid)
+        return 'break'